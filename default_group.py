@@ -0,0 +1,34 @@
+'''click group with a default command, shared by the scripts which grew
+subcommands but keep their original command line, e.g. `i2cget.py BUS ADDR`
+still runs `i2cget.py get BUS ADDR`.
+'''
+
+import click
+
+
+class DefaultGroup(click.Group):
+    """A group which runs default_cmd when no command name is given.
+
+    Use it as @click.group(cls=DefaultGroup, default_cmd='get'). Group options
+    may come first, e.g. `grep_in_deb.py --db X PATTERN`.
+    """
+
+    def __init__(self, *args, default_cmd=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_cmd = default_cmd
+
+    def _is_group_option(self, ctx, arg):
+        name = arg.split('=', 1)[0]
+        return any(name in p.opts or name in p.secondary_opts for p in self.get_params(ctx))
+
+    def parse_args(self, ctx, args):
+        # arguments or options of the default command only, e.g. `-w 2 BUS ADDR`
+        if not args or (args[0] not in self.commands and not self._is_group_option(ctx, args[0])):
+            args = [self.default_cmd] + args
+        return super().parse_args(ctx, args)
+
+    def resolve_command(self, ctx, args):
+        # what is left after the group options
+        if args and args[0] not in self.commands:
+            args = [self.default_cmd] + args
+        return super().resolve_command(ctx, args)
@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import subprocess
+import click
+from default_group import DefaultGroup
+
+try:
+    import re._parser as sre_parse
+except ImportError:
+    import sre_parse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def run_git(repo, args):
+    ret = subprocess.run(['git', '-C', repo] + args, capture_output=True)
+    if ret.returncode != 0:
+        raise RuntimeError(f'git {args} in {repo} failed: {ret.stderr.decode(errors="replace")}')
+    return ret.stdout.decode('utf-8', errors='replace').splitlines()
+
+def list_submodules(repo):
+    '''paths of (checked out) submodules, like `git submodule | awk '{print $2}'`'''
+    return [l.split()[1] for l in run_git(repo, ['submodule']) if len(l.split()) >= 2]
+
+
+class CatFile():
+    """One `git cat-file --batch` pipe to read objects by sha"""
+
+    def __init__(self, repo):
+        self.proc = subprocess.Popen(['git', '-C', repo, 'cat-file', '--batch'],
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.proc.stdin.close()
+        self.proc.stdout.close()
+        self.proc.wait()
+
+    def read(self, sha):
+        '''return (type, content) of an object'''
+        self.proc.stdin.write(sha.encode() + b'\n')
+        self.proc.stdin.flush()
+        hdr = self.proc.stdout.readline().split()
+        if len(hdr) != 3:
+            raise RuntimeError(f'cat-file: {b" ".join(hdr).decode()}')
+        data = self.proc.stdout.read(int(hdr[2]))
+        self.proc.stdout.read(1) # trailing LF
+        return hdr[1].decode(), data
+
+
+def parse_tree(data, hash_len=20):
+    '''raw tree object -> [(mode, name, sha)]'''
+    entries = []
+    pos = 0
+    while pos < len(data):
+        sp = data.index(b' ', pos)
+        nul = data.index(b'\0', sp)
+        sha = data[nul + 1: nul + 1 + hash_len].hex()
+        entries.append((data[pos:sp], data[sp + 1: nul].decode('utf-8', errors='replace'), sha))
+        pos = nul + 1 + hash_len
+    return entries
+
+def grep_blob(regex, data):
+    '''yield (line_no, line) of lines matched by regex (bytes pattern)'''
+    pos = 0
+    line_no = 1
+    counted = 0
+    while True:
+        m = regex.search(data, pos)
+        if m is None:
+            return
+        start = data.rfind(b'\n', 0, m.start()) + 1
+        end = data.find(b'\n', m.start())
+        end = len(data) if end < 0 else end
+        line_no += data.count(b'\n', counted, start)
+        counted = start
+        yield line_no, data[start:end]
+        pos = end + 1
+
+
+class HistoryGrep():
+    """Greps all commits since a date, each distinct blob is read and grepped once.
+
+    Trees are memoized by sha as well, so an unchanged subtree shared by many
+    commits is walked once. Hits are mapped back to every commit and path
+    which contains the blob.
+    """
+
+    BLOB_MODES = {b'100644', b'100755'}
+    TREE_MODE = b'40000'
+    BINARY_PEEK = 8000 # like git, a NUL in the first bytes means binary
+
+    def __init__(self, repo, regex, index=None):
+        '''index: a TrigramIndex to skip indexed blobs which can't match'''
+        self.repo = repo
+        self.regex = regex
+        self.known, self.candidates = index.lookup(regex.pattern) if index else (None, None)
+        self.hash_len = 32 if self._object_format() == 'sha256' else 20
+        self.blob_hits = dict() # blob sha -> [(line_no, line)] or 'binary', matched ones only
+        self.grepped = set()
+        self.tree_hits = dict() # tree sha -> [(rel path, blob sha)]
+
+    def _object_format(self):
+        try:
+            return run_git(self.repo, ['rev-parse', '--show-object-format'])[0]
+        except (RuntimeError, IndexError):
+            return 'sha1'
+
+    def commits(self, since):
+        '''[(commit, tree)] of all refs since the date (anything `git log --since` takes)'''
+        lines = run_git(self.repo, ['log', '--all', f'--since={since}', '--format=%H %T'])
+        return [tuple(l.split()) for l in lines]
+
+    def _grep_blob(self, cat, sha):
+        if sha in self.grepped:
+            return sha in self.blob_hits
+        self.grepped.add(sha)
+        if self.candidates is not None and sha in self.known and sha not in self.candidates:
+            return False
+        data = cat.read(sha)[1]
+        if self.regex.search(data) is None:
+            return False
+        if b'\0' in data[:self.BINARY_PEEK]:
+            self.blob_hits[sha] = 'binary'
+        else:
+            self.blob_hits[sha] = list(grep_blob(self.regex, data))
+        return True
+
+    def _walk(self, cat, tree):
+        '''return [(rel path, blob sha)] of matched blobs in tree'''
+        if tree in self.tree_hits:
+            return self.tree_hits[tree]
+        hits = []
+        for mode, name, sha in parse_tree(cat.read(tree)[1], self.hash_len):
+            if mode == self.TREE_MODE:
+                hits.extend((f'{name}/{path}', blob) for path, blob in self._walk(cat, sha))
+            elif mode in self.BLOB_MODES and self._grep_blob(cat, sha):
+                hits.append((name, sha))
+        self.tree_hits[tree] = hits
+        return hits
+
+    def grep(self, since):
+        '''yield output lines like `git grep -n` on each commit'''
+        with CatFile(self.repo) as cat:
+            for commit, tree in self.commits(since):
+                for path, blob in self._walk(cat, tree):
+                    hits = self.blob_hits[blob]
+                    if hits == 'binary':
+                        yield f'Binary file {commit}:{path} matches'
+                        continue
+                    for line_no, line in hits:
+                        yield f'{commit}:{path}:{line_no}:{line.decode("utf-8", errors="replace")}'
+
+
+################## trigram index #######################
+
+def trigrams(data):
+    '''sorted distinct trigrams of data, as 24-bit ints'''
+    if np is not None:
+        v = np.frombuffer(data, dtype=np.uint8).astype(np.uint32)
+        return np.unique((v[:-2] << 16) | (v[1:-1] << 8) | v[2:])
+    return sorted({int.from_bytes(data[i:i+3], 'big') for i in range(len(data) - 2)})
+
+MAX_ALTERNATIVES = 64
+
+def _required_literals(items):
+    '''
+    return alternatives (a list of lists) of literal bytes which must all be in
+    a text matched by the parsed regex items. Dropping a requirement is always
+    safe, it only makes the candidates wider.
+    '''
+    alts = [[]]
+    run = bytearray()
+
+    def flush():
+        if len(run) >= 3:
+            for alt in alts:
+                alt.append(bytes(run))
+        run.clear()
+
+    def combine(subs):
+        nonlocal alts
+        if len(alts) * len(subs) <= MAX_ALTERNATIVES:
+            alts = [alt + sub for alt in alts for sub in subs]
+
+    for op, av in items:
+        if op == sre_parse.LITERAL and av < 256:
+            run.append(av)
+            continue
+        flush()
+        if op == sre_parse.SUBPATTERN:
+            # (?i:...) matches any case, its literals can't be required as is
+            if not av[1] & re.IGNORECASE:
+                combine(_required_literals(av[-1]))
+        elif op == sre_parse.BRANCH:
+            combine([alt for branch in av[1] for alt in _required_literals(branch)])
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            combine(_required_literals(av[2]))
+    flush()
+    return alts
+
+def required_trigrams(pattern):
+    '''
+    alternatives of trigram sets for a bytes regex, None if it can't be narrowed
+
+    >>> required_trigrams(rb'(?i:foobar)') is None
+    True
+    >>> [sorted(t.to_bytes(3, 'big') for t in tris) for tris in required_trigrams(rb'x(?i:foo)abc')]
+    [[b'abc']]
+    '''
+    parsed = sre_parse.parse(pattern)
+    if parsed.state.flags & re.IGNORECASE:
+        return None
+    alts = []
+    for lits in _required_literals(list(parsed)):
+        tris = {int.from_bytes(lit[i:i+3], 'big') for lit in lits for i in range(len(lit) - 2)}
+        if not tris:
+            return None
+        alts.append(tris)
+    return alts
+
+
+class TrigramIndex():
+    """Trigram -> blob postings of a repo, kept in <git dir>/gitgrep_index.
+
+    Every update appends segments for blobs not seen before. A segment is a
+    sorted trigram array, an offset array and the postings (blob ids), all
+    array('I') files, postings are memory-mapped when queried. Binary and
+    huge blobs aren't indexed, so they are always grepped.
+    """
+
+    MAX_BLOB = 1 << 20
+    SEGMENT_BLOBS = 4096
+
+    def __init__(self, repo):
+        self.repo = repo
+        git_dir = run_git(repo, ['rev-parse', '--git-dir'])[0]
+        self.dir = os.path.join(repo, git_dir, 'gitgrep_index')
+        self.meta_path = os.path.join(self.dir, 'meta.json')
+        try:
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {'tips': [], 'segments': 0, 'blobs': 0, 'skipped': 0}
+
+    def exists(self):
+        return self.meta['segments'] > 0 or self.meta['skipped'] > 0
+
+    def clear(self):
+        if os.path.isdir(self.dir):
+            for name in os.listdir(self.dir):
+                os.remove(os.path.join(self.dir, name))
+        self.meta = {'tips': [], 'segments': 0, 'blobs': 0, 'skipped': 0}
+
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+
+    def _read_list(self, name, count):
+        '''first count lines of a file, lines beyond meta are from an aborted update'''
+        try:
+            with open(self._path(name)) as f:
+                return [l.rstrip('\n') for _, l in zip(range(count), f)]
+        except OSError:
+            return []
+
+    def _write_segment(self, seg, batch):
+        '''batch: [(blob id, trigrams)]'''
+        if np is not None:
+            ids = np.repeat(np.array([i for i, _ in batch], dtype=np.uint32),
+                            [len(t) for _, t in batch])
+            tris = np.concatenate([np.asarray(t, dtype=np.uint32) for _, t in batch])
+            order = np.argsort(tris, kind='stable')
+            tris, ids = tris[order], ids[order]
+            keys, starts = np.unique(tris, return_index=True)
+            keys = array('I', keys.astype(np.uint32).tobytes())
+            offsets = array('I', np.append(starts, len(tris)).astype(np.uint32).tobytes())
+            postings = array('I', ids.tobytes())
+        else:
+            by_tri = dict()
+            for blob_id, tris in batch:
+                for t in tris:
+                    by_tri.setdefault(t, array('I')).append(blob_id)
+            keys, offsets, postings = array('I'), array('I'), array('I')
+            for t in sorted(by_tri):
+                keys.append(t)
+                offsets.append(len(postings))
+                postings.extend(by_tri[t])
+            offsets.append(len(postings))
+        for ext, arr in (('tri', keys), ('ofs', offsets), ('post', postings)):
+            with open(self._path(f'seg{seg}.{ext}'), 'wb') as f:
+                arr.tofile(f)
+
+    def _new_trees(self, since):
+        args = ['log', '--all', '--format=%T'] + ([f'--since={since}'] if since else [])
+        if self.meta['tips']:
+            try:
+                return run_git(self.repo, args + ['--not'] + self.meta['tips'])
+            except RuntimeError:
+                pass # an old tip was gc-ed, walk everything, known blobs are skipped anyway
+        return run_git(self.repo, args)
+
+    def update(self, since=None):
+        '''index blobs of commits added since the last update, return the number of them'''
+        os.makedirs(self.dir, exist_ok=True)
+        known = set(self._read_list('blobs.txt', self.meta['blobs']))
+        known.update(self._read_list('skipped.txt', self.meta['skipped']))
+        tips = run_git(self.repo, ['rev-parse', '--all'])
+        hash_len = HistoryGrep(self.repo, re.compile(b'')).hash_len
+        seen_trees = set()
+        new_blobs = []
+
+        def walk(cat, tree):
+            seen_trees.add(tree)
+            for mode, name, sha in parse_tree(cat.read(tree)[1], hash_len):
+                if mode == HistoryGrep.TREE_MODE and sha not in seen_trees:
+                    walk(cat, sha)
+                elif mode in HistoryGrep.BLOB_MODES and sha not in known:
+                    known.add(sha)
+                    new_blobs.append(sha)
+
+        batch = []
+        with CatFile(self.repo) as cat, open(self._path('blobs.txt'), 'a') as blobs_f, \
+                open(self._path('skipped.txt'), 'a') as skipped_f:
+            for tree in self._new_trees(since):
+                if tree not in seen_trees:
+                    walk(cat, tree)
+            for sha in new_blobs:
+                data = cat.read(sha)[1]
+                if len(data) > self.MAX_BLOB or b'\0' in data[:HistoryGrep.BINARY_PEEK]:
+                    skipped_f.write(sha + '\n')
+                    self.meta['skipped'] += 1
+                    continue
+                blobs_f.write(sha + '\n')
+                batch.append((self.meta['blobs'], trigrams(data)))
+                self.meta['blobs'] += 1
+                if len(batch) >= self.SEGMENT_BLOBS:
+                    self._write_segment(self.meta['segments'], batch)
+                    self.meta['segments'] += 1
+                    batch = []
+            if batch:
+                self._write_segment(self.meta['segments'], batch)
+                self.meta['segments'] += 1
+        self.meta['tips'] = tips
+        tmp = self.meta_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, self.meta_path)
+        return len(new_blobs)
+
+    def _segments(self):
+        for seg in range(self.meta['segments']):
+            keys, offsets = array('I'), array('I')
+            with open(self._path(f'seg{seg}.tri'), 'rb') as f:
+                keys.frombytes(f.read())
+            with open(self._path(f'seg{seg}.ofs'), 'rb') as f:
+                offsets.frombytes(f.read())
+            with open(self._path(f'seg{seg}.post'), 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                post = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+            yield keys, offsets, post
+
+    def lookup(self, pattern):
+        '''
+        return (indexed blob shas, candidate blob shas) for a bytes regex, the
+        regex can't match an indexed blob which isn't a candidate. (None, None)
+        if the regex can't be narrowed down.
+        '''
+        alts = required_trigrams(pattern)
+        if alts is None:
+            return None, None
+        wanted = set().union(*alts)
+        postings = {t: set() for t in wanted}
+        for keys, offsets, post in self._segments():
+            view = memoryview(post).cast('I') if len(post) else []
+            for t in wanted:
+                i = bisect_left(keys, t)
+                if i < len(keys) and keys[i] == t:
+                    postings[t].update(view[offsets[i]: offsets[i + 1]])
+            if isinstance(view, memoryview):
+                view.release()
+                post.close()
+        ids = set()
+        for tris in alts:
+            ids |= set.intersection(*(postings[t] for t in tris))
+        blobs = self._read_list('blobs.txt', self.meta['blobs'])
+        return set(blobs), {blobs[i] for i in ids}
+
+
+def grep_repo(repo, regexp, since, invert, queue=None, batch=256, use_index=True):
+    '''grep one repo, lines are put into queue as (repo, [lines]) or returned'''
+    regex = re.compile(regexp.encode(), re.MULTILINE)
+    inv = re.compile(invert) if invert else None
+    index = TrigramIndex(repo) if use_index else None
+    res = []
+    for line in HistoryGrep(repo, regex, index if index and index.exists() else None).grep(since):
+        if inv is not None and inv.search(line):
+            continue
+        res.append(line)
+        if queue is not None and len(res) >= batch:
+            queue.put((repo, res))
+            res = []
+    if queue is not None and res:
+        queue.put((repo, res))
+        res = []
+    return res
+
+
+def index_repo(repo, since=None, rebuild=False):
+    idx = TrigramIndex(repo)
+    if rebuild:
+        idx.clear()
+    return repo, idx.update(since)
+
+
+@click.group(cls=DefaultGroup, default_cmd='grep')
+def root():
+    '''history grep of a repo and its submodules, `grep` is the default command'''
+    pass
+
+@root.command()
+@click.option('--since', type=click.STRING, default=None,
+              help='only index commits since the date, all history by default')
+@click.option('--rebuild', is_flag=True, default=False, help='drop the index and build it again')
+@click.option('--jobs', '-j', type=click.INT, default=os.cpu_count(), show_default=True,
+              help='number of repos (main repo and submodules) indexed in parallel')
+def index(since, rebuild, jobs):
+    '''build/update the trigram index of this repo and its submodules'''
+    repos = ['.'] + list_submodules('.')
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for repo, n in pool.map(index_repo, repos, [since] * len(repos), [rebuild] * len(repos)):
+            click.echo(f'{os.path.abspath(repo)}: {n} new blobs indexed')
+
+@root.command()
+@click.argument('regexp', type=click.STRING)
+@click.argument('date', type=click.STRING)
+@click.argument('invert_regexp', type=click.STRING, default='')
+@click.option('--jobs', '-j', type=click.INT, default=os.cpu_count(), show_default=True,
+              help='number of repos (main repo and submodules) grepped in parallel')
+@click.option('--no-index', is_flag=True, default=False,
+              help="don't narrow down blobs by the trigram index")
+def grep(regexp, date, invert_regexp, jobs, no_index):
+    '''
+    grep REGEXP (python regex) in all commits since DATE (e.g. 'Jun 1 2021')
+    of this repo and its submodules, lines matching INVERT_REGEXP are dropped.
+    '''
+    repos = ['.'] + list_submodules('.')
+    with multiprocessing.Manager() as manager:
+        queue = manager.Queue()
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(grep_repo, repo, regexp, date, invert_regexp, queue,
+                                   use_index=not no_index)
+                       for repo in repos]
+            for repo, f in zip(repos, futures):
+                f.add_done_callback(lambda f, repo=repo: queue.put((repo, None)))
+            # one repo after another like the old script: the first unfinished
+            # repo is streamed, lines of the others are held until its turn
+            held = {repo: [] for repo in repos}
+            finished = set()
+            pos = 0
+            click.echo(f'.....grep in {os.path.abspath(repos[0])}.....')
+            while pos < len(repos):
+                repo, lines = queue.get()
+                if lines is None:
+                    finished.add(repo)
+                else:
+                    held[repo].append(lines)
+                while pos < len(repos):
+                    current = repos[pos]
+                    for lines in held[current]:
+                        click.echo('\n'.join(lines))
+                    held[current] = []
+                    if current not in finished:
+                        break
+                    pos += 1
+                    if pos < len(repos):
+                        click.echo(f'.....grep in {os.path.abspath(repos[pos])}.....')
+            for f in futures:
+                f.result()
+
+if __name__ == "__main__":
+    root()
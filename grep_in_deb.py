@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import tarfile
+import threading
+import click
+from default_group import DefaultGroup
+
+AR_MAGIC = b'!<arch>\n'
+AR_HDR_LEN = 60
+
+def iter_ar_members(f):
+    '''yield (name, offset, size) of members in an ar archive (a .deb)'''
+    if f.read(len(AR_MAGIC)) != AR_MAGIC:
+        raise ValueError('not an ar archive')
+    offset = len(AR_MAGIC)
+    while True:
+        f.seek(offset)
+        hdr = f.read(AR_HDR_LEN)
+        if len(hdr) < AR_HDR_LEN:
+            return
+        name = hdr[0:16].decode('ascii', errors='replace').strip().rstrip('/')
+        size = int(hdr[48:58])
+        yield name, offset + AR_HDR_LEN, size
+        offset += AR_HDR_LEN + size + (size & 1) # members are 2-byte aligned
+
+
+class MemberReader():
+    """File-like reader limited to one ar member"""
+
+    def __init__(self, f, offset, size):
+        self.f = f
+        self.f.seek(offset)
+        self.remaining = size
+
+    def read(self, n=-1):
+        if n is None or n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.f.read(n)
+        self.remaining -= len(data)
+        return data
+
+
+class ZstdPipe():
+    """Decompresses a reader through the `zstd` command, for pythons without zstandard"""
+
+    def __init__(self, reader):
+        self.proc = subprocess.Popen(['zstd', '-dc'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.feeder = threading.Thread(target=self._feed, args=(reader,), daemon=True)
+        self.feeder.start()
+
+    def _feed(self, reader):
+        try:
+            for chunk in iter(lambda: reader.read(1 << 16), b''):
+                self.proc.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def read(self, n=-1):
+        return self.proc.stdout.read(n)
+
+    def close(self):
+        self.proc.stdout.close()
+        self.proc.wait()
+        self.feeder.join()
+
+
+def open_data_tar(f, name, offset, size):
+    '''return a streaming tarfile of the data.tar.* member'''
+    reader = MemberReader(f, offset, size)
+    ext = name[len('data.tar'):]
+    if ext == '.zst':
+        try:
+            import zstandard
+            reader = zstandard.ZstdDecompressor().stream_reader(reader)
+        except ImportError:
+            if shutil.which('zstd') is None:
+                raise RuntimeError('data.tar.zst needs python zstandard or the zstd command')
+            reader = ZstdPipe(reader)
+        return tarfile.open(fileobj=reader, mode='r|'), reader
+    mode = {'': 'r|', '.gz': 'r|gz', '.xz': 'r|xz', '.bz2': 'r|bz2'}[ext]
+    return tarfile.open(fileobj=reader, mode=mode), None
+
+def iter_deb_members(path):
+    '''
+    yield (path, mode, size) of files in the data.tar of a .deb, paths are like
+    `dpkg -c` shows them (dirs end with '/'). Only member headers are parsed,
+    file contents are skipped.
+    '''
+    with open(path, 'rb') as f:
+        for name, offset, size in iter_ar_members(f):
+            if not name.startswith('data.tar'):
+                continue
+            tar, pipe = open_data_tar(f, name, offset, size)
+            try:
+                for info in tar:
+                    yield (info.name + '/' if info.isdir() else info.name), info.mode, info.size
+            finally:
+                tar.close()
+                if pipe is not None and hasattr(pipe, 'close'):
+                    pipe.close()
+            return
+
+def list_deb(path):
+    '''yield paths in the data.tar of a .deb'''
+    for name, _, _ in iter_deb_members(path):
+        yield name
+
+def grep_deb(path, pattern):
+    '''return (path, matched paths or an error string)'''
+    regex = re.compile(pattern)
+    try:
+        return path, [p for p in list_deb(path) if regex.search(p)]
+    except (OSError, ValueError, KeyError, RuntimeError, tarfile.TarError) as e:
+        return path, f'{type(e).__name__}: {e}'
+
+def index_deb(path):
+    '''return (path, size, mtime_ns, [(path, mode, size)] or an error string)'''
+    st = os.stat(path)
+    try:
+        members = list(iter_deb_members(path))
+    except (OSError, ValueError, KeyError, RuntimeError, tarfile.TarError) as e:
+        members = f'{type(e).__name__}: {e}'
+    return path, st.st_size, st.st_mtime_ns, members
+
+
+class DebIndex():
+    """SQLite index of .deb file lists, a package is re-read only when its
+    size or mtime changed"""
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS packages (
+            id INTEGER PRIMARY KEY, path TEXT UNIQUE, size INTEGER, mtime INTEGER, error TEXT);
+        CREATE TABLE IF NOT EXISTS members (pkg INTEGER, path TEXT, mode INTEGER, size INTEGER);
+        CREATE INDEX IF NOT EXISTS members_path ON members(path);
+        CREATE INDEX IF NOT EXISTS members_pkg ON members(pkg);
+    '''
+
+    def __init__(self, db_path):
+        db_path = os.path.expanduser(db_path)
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(self.SCHEMA)
+        self.conn.create_function('regexp', 2, self._regexp, deterministic=True)
+        self._regex = None
+
+    def _regexp(self, pattern, value):
+        if self._regex is None or self._regex.pattern != pattern:
+            self._regex = re.compile(pattern)
+        return self._regex.search(value) is not None
+
+    @staticmethod
+    def _under(top):
+        '''LIKE pattern of paths under top'''
+        top = os.path.abspath(top).rstrip('/')
+        return re.sub(r'([\\%_])', r'\\\1', top) + '/%'
+
+    def update(self, top, jobs):
+        '''index new or modified .deb under top, drop removed ones, return (added, removed)'''
+        known = {path: (size, mtime) for path, size, mtime in self.conn.execute(
+                 "SELECT path, size, mtime FROM packages WHERE path LIKE ? ESCAPE '\\'",
+                 (self._under(top),))}
+        stale = []
+        for path in find_debs(os.path.abspath(top)):
+            st = os.stat(path)
+            if known.pop(path, None) != (st.st_size, st.st_mtime_ns):
+                stale.append(path)
+        with self.conn:
+            for path in known: # gone
+                self._delete(path)
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                for path, size, mtime, members in pool.map(index_deb, stale, chunksize=8):
+                    self._delete(path)
+                    error = members if isinstance(members, str) else None
+                    cur = self.conn.execute(
+                        'INSERT INTO packages (path, size, mtime, error) VALUES (?, ?, ?, ?)',
+                        (path, size, mtime, error))
+                    if error is None:
+                        self.conn.executemany(
+                            'INSERT INTO members (pkg, path, mode, size) VALUES (?, ?, ?, ?)',
+                            ((cur.lastrowid, *m) for m in members))
+        return len(stale), len(known)
+
+    def _delete(self, path):
+        self.conn.execute('DELETE FROM members WHERE pkg IN (SELECT id FROM packages WHERE path = ?)',
+                          (path,))
+        self.conn.execute('DELETE FROM packages WHERE path = ?', (path,))
+
+    def grep(self, top, pattern):
+        '''yield (deb path, member path) of members matching pattern (python regex)'''
+        return self.conn.execute(
+            "SELECT p.path, m.path FROM members m JOIN packages p ON m.pkg = p.id "
+            "WHERE p.path LIKE ? ESCAPE '\\' AND m.path REGEXP ? ORDER BY p.path, m.rowid",
+            (self._under(top), pattern))
+
+    def owners(self, top, path):
+        '''yield (deb path, member path, mode, size) of packages shipping path'''
+        if not path.startswith('./'):
+            path = '.' + path if path.startswith('/') else './' + path
+        return self.conn.execute(
+            "SELECT p.path, m.path, m.mode, m.size FROM members m JOIN packages p ON m.pkg = p.id "
+            "WHERE m.path IN (?, ?) AND p.path LIKE ? ESCAPE '\\' ORDER BY p.path",
+            (path, path.rstrip('/') + '/', self._under(top)))
+
+    def errors(self, top):
+        return self.conn.execute(
+            "SELECT path, error FROM packages WHERE error IS NOT NULL AND path LIKE ? ESCAPE '\\'",
+            (self._under(top),))
+
+
+def find_debs(top):
+    '''.deb files under top, in walk order like `find . | grep -P ".\\.deb$"`'''
+    for dirpath, dirnames, filenames in os.walk(top):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if len(name) > 4 and name.endswith('.deb'):
+                yield os.path.join(dirpath, name)
+
+
+def display_path(top, path):
+    '''absolute deb path -> path under top as given by the user'''
+    return os.path.join(top, os.path.relpath(path, os.path.abspath(top)))
+
+@click.group(cls=DefaultGroup, default_cmd='grep')
+@click.option('--db', type=click.STRING, default='~/.cache/grep_in_deb/index.sqlite',
+              show_default=True, help='the file list index')
+@click.option('--jobs', '-j', type=click.INT, default=os.cpu_count(), show_default=True,
+              help='number of worker processes')
+@click.pass_context
+def root(ctx, db, jobs):
+    '''search file lists of .deb files, `grep` is the default command'''
+    ctx.obj = {'db': db, 'jobs': jobs}
+
+def _updated_index(ctx, top):
+    idx = DebIndex(ctx.obj['db'])
+    added, removed = idx.update(top, ctx.obj['jobs'])
+    if added or removed:
+        click.echo(f'index: {added} packages (re)indexed, {removed} removed', err=True)
+    for path, error in idx.errors(top):
+        click.echo(f'--- {display_path(top, path)}: {error} ---', err=True)
+    return idx
+
+@root.command()
+@click.argument('pattern', type=click.STRING)
+@click.argument('top', type=click.Path(exists=True, file_okay=False), default='.')
+@click.option('--no-index', is_flag=True, default=False,
+              help='read all .deb files instead of using (and updating) the index')
+@click.pass_context
+def grep(ctx, pattern, top, no_index):
+    '''grep PATTERN (python regex) in file lists of all .deb under TOP recursively'''
+    click.echo(f'start grepping {pattern} in .deb files recurisvely ...')
+    if no_index:
+        scan(pattern, top, ctx.obj['jobs'])
+        return
+    current = None
+    for deb, path in _updated_index(ctx, top).grep(top, pattern):
+        if deb != current:
+            click.echo(f'--- Content of {display_path(top, deb)} ---')
+            current = deb
+        click.echo(path)
+
+@root.command()
+@click.argument('path', type=click.STRING)
+@click.argument('top', type=click.Path(exists=True, file_okay=False), default='.')
+@click.pass_context
+def owner(ctx, path, top):
+    '''list packages under TOP which ship PATH, e.g. /usr/bin/sonic-cfggen'''
+    for deb, member, mode, size in _updated_index(ctx, top).owners(top, path):
+        click.echo(f'{display_path(top, deb)}: {member} {mode:o} {size}')
+
+def scan(pattern, top, jobs):
+    debs = list(find_debs(top))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for path, res in pool.map(grep_deb, debs, [pattern] * len(debs)):
+            if isinstance(res, str):
+                click.echo(f'--- {path}: {res} ---', err=True)
+            elif res:
+                click.echo(f'--- Content of {path} ---')
+                click.echo('\n'.join(res))
+
+if __name__ == "__main__":
+    root()
@@ -2,14 +2,26 @@
 import click
 import subprocess
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import codecs
+import json
+import os
+import random
 import re
+import time
+
+GH = os.environ.get('GH', 'gh') # path of github cli, e.g. a wrapper or a fake gh
 
 PrDesc = namedtuple('PrDesc', [
    'num',
    'title',
    'branch',
-   'status'
-])
+   'status',
+   'head'
+], defaults=(None,))
+
+class RateLimitError(RuntimeError):
+    pass
 
 def print_list(l):
     for i in l:
@@ -18,35 +30,280 @@ def print_list(l):
 def run_cmd(args):
     ret = subprocess.run(args, capture_output=True)
     if ret.returncode != 0:
-        raise RuntimeError(f'Cmd: {args} failed, ret={ret.returncode})')
+        err = ret.stderr.decode('utf-8', errors='replace').strip()
+        exc = RateLimitError if 'rate limit' in err.lower() else RuntimeError
+        raise exc(f'Cmd: {args} failed, ret={ret.returncode}) {err}')
     return ret.stdout.decode('utf-8', errors='replace').splitlines()
 
+def iter_cmd_lines(args, limit=64 * 1024):
+    '''
+    yield stdout lines (bytes) of a cmd as they come instead of buffering the
+    whole output, a line longer than limit is yielded in pieces.
+    '''
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for line in iter(lambda: proc.stdout.readline(limit), b''):
+            yield line
+    finally:
+        proc.stdout.close()
+        err = proc.stderr.read().decode('utf-8', errors='replace').strip()
+        proc.stderr.close()
+        ret = proc.wait()
+    if ret != 0:
+        exc = RateLimitError if 'rate limit' in err.lower() else RuntimeError
+        raise exc(f'Cmd: {args} failed, ret={ret}) {err}')
+
+def unquote_git_path(path):
+    '''git quotes paths with special chars like C strings, e.g. "a/\\303\\251"'''
+    if path.startswith(b'"') and path.endswith(b'"'):
+        path = codecs.escape_decode(path[1:-1])[0]
+    return path.decode('utf-8', errors='replace')
+
+def split_diff_header(rest):
+    '''"a/X b/Y" of a `diff --git` line -> (X, Y)'''
+    if rest.startswith(b'"'):
+        end = re.match(rb'"(?:[^"\\]|\\.)*"', rest).end()
+        a, b = rest[:end], rest[end + 1:]
+    else:
+        n = (len(rest) - 5) // 2 # "a/X b/X" when not renamed
+        if rest[2:2 + n] == rest[5 + n:] and rest[2 + n: 5 + n] == b' b/':
+            a, b = rest[:2 + n], rest[3 + n:]
+        else:
+            a, _, b = rest.partition(b' "b/' if b' "b/' in rest else b' b/')
+            b = (b'"b/' if rest[len(a) + 1:].startswith(b'"') else b'b/') + b
+    return unquote_git_path(a)[2:], unquote_git_path(b)[2:]
+
+def parse_diff_files(lines):
+    '''
+    list files of a diff from its headers, renamed files are given by their new
+    name. lines (bytes) can be an iterator, hunk bodies are never kept.
+    '''
+    files = []
+    at_line_start = True
+    for line in lines:
+        if at_line_start:
+            if line.startswith(b'diff --git '):
+                files.append(split_diff_header(line[11:].rstrip(b'\n'))[1])
+            elif line.startswith(b'rename to ') and files:
+                files[-1] = unquote_git_path(line[10:].rstrip(b'\n'))
+        at_line_start = line.endswith(b'\n')
+    return files
+
+HUNK_HDR = re.compile(rb'@@ -(\d+)(?:,\d+)? \+(\d+)')
+
+class MultiMatcher():
+    """Several regexes, on str or bytes.
+
+    Each pattern is compiled on its own, so it keeps its own flags and group
+    numbers like a plain re.search(). When it is safe, i.e. no global flags or
+    backrefs, they are also combined into one alternation which rules out
+    non-matching lines in one scan; the patterns are only tried one by one on
+    lines which match it.
+    """
+
+    UNSAFE = re.compile(r'\(\?[aiLmsux]+\)|\\[1-9]|\(\?P=|\(\?\(')
+
+    def __init__(self, patts, binary=False):
+        encode = (lambda p: p.encode()) if binary else (lambda p: p)
+        self.regexes = [re.compile(encode(p)) for p in patts]
+        self.combined = None
+        if len(patts) > 1 and not any(self.UNSAFE.search(p) for p in patts):
+            try:
+                self.combined = re.compile(encode('|'.join(f'(?:{p})' for p in patts)))
+            except re.error: # e.g. the same group name in two patterns
+                pass
+
+    def search(self, s):
+        '''return the index of the first matched pattern, None if no match'''
+        if self.combined is not None and self.combined.search(s) is None:
+            return None
+        return next((i for i, regex in enumerate(self.regexes) if regex.search(s)), None)
+
+def iter_diff_hits(lines, matcher):
+    '''
+    yield (file, line_no, line) of added/removed lines matched by matcher (bytes
+    patterns), line_no is in the new file for '+' and the old file for '-'.
+    '''
+    path = None
+    in_hunk = False
+    kind = b''
+    old = new = 0
+    at_line_start = True
+    for line in lines:
+        if not at_line_start: # rest of a long line
+            if kind in (b'+', b'-') and matcher.search(line) is not None:
+                yield path, (new if kind == b'+' else old) - 1, line.decode('utf-8', errors='replace')
+        elif line.startswith(b'diff --git '):
+            path = split_diff_header(line[11:].rstrip(b'\n'))[1]
+            in_hunk = False
+            kind = b''
+        elif line.startswith(b'@@'):
+            m = HUNK_HDR.match(line)
+            if m is not None:
+                old, new = int(m.group(1)), int(m.group(2))
+                in_hunk = True
+            kind = b''
+        elif not in_hunk:
+            if line.startswith(b'rename to '):
+                path = unquote_git_path(line[10:].rstrip(b'\n'))
+            kind = b''
+        else:
+            kind = line[:1]
+            if kind == b'\\': # "\ No newline at end of file", not a line of either file
+                at_line_start = line.endswith(b'\n')
+                continue
+            if kind == b'+' or kind == b'-':
+                line_no = new if kind == b'+' else old
+                if matcher.search(memoryview(line)[1:]) is not None:
+                    yield path, line_no, line.rstrip(b'\n').decode('utf-8', errors='replace')
+            if kind != b'-':
+                new += 1
+            if kind != b'+':
+                old += 1
+        at_line_start = line.endswith(b'\n')
+
+def with_backoff(func, *args, retries=5, delay=2.0):
+    '''call func, back off exponentially (with jitter) on RateLimitError'''
+    for i in range(retries):
+        try:
+            return func(*args)
+        except RateLimitError:
+            if i == retries - 1:
+                raise
+            time.sleep(delay * (2 ** i) * (1 + random.random()))
+
 class PrReader():
     @staticmethod
     def list_all():
-        ''' return a list of (opened) PR'''
-        lines = run_cmd(['gh', 'pr', 'list', '-L', '800'])
+        ''' return a list of (opened) PR, with their head commit sha'''
+        lines = run_cmd([GH, 'pr', 'list', '-L', '800', '--json',
+                         'number,title,headRefName,state,headRefOid'])
         prs = []
-        for l in lines:
-            words = l.split('\t')
-            if words[3] == 'OPEN':
-                prs.append(PrDesc(words[0], words[1], words[2], words[3]))
+        for pr in json.loads('\n'.join(lines)):
+            if pr['state'] == 'OPEN':
+                prs.append(PrDesc(str(pr['number']), pr['title'], pr['headRefName'],
+                                  pr['state'], pr['headRefOid']))
         return prs
 
+    name_only = True # whether `gh pr diff --name-only` is supported
+
     @staticmethod
     def list_mod_files_by_pr(num):
         '''list all modified files by given PR num(type:str)'''
-        diff = run_cmd(['gh', 'pr', 'diff', num])
-        file_lines = [l for l in diff if l.startswith('diff --git')]
-        files = [l.split()[2][2:] for l in file_lines] # drop first two chars 'a/'
-        return files
+        if PrReader.name_only:
+            try:
+                return run_cmd([GH, 'pr', 'diff', '--name-only', num])
+            except RateLimitError:
+                raise
+            except RuntimeError as e:
+                if 'unknown flag' not in str(e):
+                    raise
+                PrReader.name_only = False # old gh, parse the streamed diff instead
+        return parse_diff_files(iter_cmd_lines([GH, 'pr', 'diff', num]))
+
+    @staticmethod
+    def grep_diff(num, matcher):
+        '''list (file, line_no, line) of added/removed lines matched in PR num'''
+        return list(iter_diff_hits(iter_cmd_lines([GH, 'pr', 'diff', num]), matcher))
+
+    @staticmethod
+    def iter_fetch(prs, func, jobs, *args):
+        '''yield (pr, func(pr.num, *args)) in completion order, with `jobs` threads'''
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(with_backoff, func, pr.num, *args): pr for pr in prs}
+            for f in as_completed(futures):
+                yield futures[f], f.result()
+
+    @staticmethod
+    def iter_mod_files(prs, jobs):
+        '''yield (pr, files) in completion order, fetching with `jobs` threads'''
+        return PrReader.iter_fetch(prs, PrReader.list_mod_files_by_pr, jobs)
+
+class FileListCache():
+    """PR modified files cached on disk, keyed by PR num and head commit sha"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = dict()
+
+    @staticmethod
+    def default_path():
+        '''~/.cache/grep_pr/<repo toplevel path>.json'''
+        ret = subprocess.run(['git', 'rev-parse', '--show-toplevel'], capture_output=True)
+        top = ret.stdout.decode().strip() if ret.returncode == 0 else os.getcwd()
+        name = re.sub(r'[^\w.-]', '_', os.path.realpath(top).strip('/'))
+        return os.path.join(os.path.expanduser('~/.cache/grep_pr'), name + '.json')
+
+    def get(self, pr):
+        '''return cached files, None if missed or the head moved'''
+        ent = self.data.get(pr.num)
+        if ent is None or pr.head is None or ent['head'] != pr.head:
+            return None
+        return ent['files']
+
+    def put(self, pr, files):
+        if pr.head is not None:
+            self.data[pr.num] = {'head': pr.head, 'files': files}
+
+    def evict_except(self, prs):
+        '''drop PRs which are not in prs (e.g. closed)'''
+        nums = {pr.num for pr in prs}
+        self.data = {num: ent for num, ent in self.data.items() if num in nums}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp = f'{self.path}.{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+
+def grep_files(prs, matcher, jobs, cache, handle):
+    '''call handle(pr, matched files) for each PR'''
+    stale = []
+    for pr in prs:
+        files = cache.get(pr) if cache is not None else None
+        if files is None:
+            stale.append(pr)
+        else:
+            handle(pr, [f for f in files if matcher.search(f) is not None])
+    if cache is not None:
+        click.echo(f'{len(prs) - len(stale)} PRs from cache, fetching {len(stale)}...')
+    try:
+        for pr, files in PrReader.iter_mod_files(stale, jobs):
+            if cache is not None:
+                cache.put(pr, files)
+            handle(pr, [f for f in files if matcher.search(f) is not None])
+    finally:
+        if cache is not None:
+            cache.evict_except(prs)
+            cache.save()
+
+def grep_content(prs, matcher, jobs, handle):
+    '''call handle(pr, ["file:line_no: +/-line"]) for each PR'''
+    for pr, hits in PrReader.iter_fetch(prs, PrReader.grep_diff, jobs, matcher):
+        handle(pr, [f'{path}:{line_no}: {line}' for path, line_no, line in hits])
 
 @click.command()
-@click.argument('regex_patt', type=click.STRING)
-def main(regex_patt):
+@click.argument('regex_patts', type=click.STRING, nargs=-1, required=True)
+@click.option('--jobs', '-j', type=click.INT, default=8, show_default=True,
+              help='number of concurrent `gh pr diff`')
+@click.option('--stream', is_flag=True, default=False,
+              help='print matched PRs as soon as they are fetched, not in PR list order')
+@click.option('--cache-file', type=click.STRING, default=None,
+              help='file list cache, ~/.cache/grep_pr/<repo>.json by default')
+@click.option('--no-cache', is_flag=True, default=False, help='fetch all PRs again')
+@click.option('--content', '-c', is_flag=True, default=False,
+              help='grep added/removed lines of the diffs instead of file paths')
+def main(regex_patts, jobs, stream, cache_file, no_cache, content):
     '''
-    Output PR-Files hierarchy while the PR has matched files with the given
-    regex_pattern.\n
+    Output PR-Files hierarchy while the PR has matched files with any of the
+    given regex_patterns. With --content, output the added/removed lines
+    matched in each PR as file:line_no: +/-line.\n
     NOTE: This script is using github cli cmd `gh` to achieve our goal. So,
     before using this script, please follow the instruction at
     https://cli.github.com/ install it, and finish all token and repo setup
@@ -54,12 +311,26 @@ def main(regex_patt):
     '''
     prs = PrReader.list_all()
     click.echo(f'Total {len(prs)} PRs, start grepping...')
-    for pr in prs:
-        files = PrReader.list_mod_files_by_pr(pr.num)
-        matches = [f for f in files if re.search(regex_patt, f)]
+    results = dict()
+
+    def handle(pr, matches):
         if matches:
+            results[pr.num] = matches
+            if stream:
+                click.echo(f'==== {pr.num}: {pr.title} ====')
+                print_list(matches)
+
+    if content:
+        grep_content(prs, MultiMatcher(regex_patts, binary=True), jobs, handle)
+    else:
+        cache = None if no_cache else FileListCache(cache_file or FileListCache.default_path())
+        grep_files(prs, MultiMatcher(regex_patts), jobs, cache, handle)
+    if stream:
+        return
+    for pr in prs:
+        if pr.num in results:
             click.echo(f'==== {pr.num}: {pr.title} ====')
-            print_list(matches)
+            print_list(results[pr.num])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,55 +1,173 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import json
+import os
+import sys
+import time
 import click
+from default_group import DefaultGroup
+from smbus_reader import SmbusBus, SmbusReader, parse_int_list
 
-def hexdump(src, length=16, sep='.'):
-    FILTER = ''.join([(len(repr(chr(x))) == 3) and chr(x) or sep for x in range(256)])
-    lines = []
-    for c in range(0, len(src), length):
-        chars = src[c:c+length]
-        hexstr = ' '.join(["%02x" % ord(x) for x in chars]) if type(chars) is str else ' '.join(['{:02x}'.format(x) for x in chars])
+@lru_cache()
+def _printable_table(sep='.'):
+    '''bytes.translate table, non-printable chars become sep'''
+    return bytes([x if x <= 127 and len(repr(chr(x))) == 3 else ord(sep) for x in range(256)])
+
+def _i2cdump_table():
+    '''0x00 and 0xff become '.', other non-printable chars become '?' like i2cdump'''
+    return bytes([ord('.') if x in (0, 0xff) else x if 32 <= x < 127 else ord('?') for x in range(256)])
+
+I2CDUMP_TABLE = _i2cdump_table()
+
+def hexdump_lines(src, length=16, sep='.', base=0):
+    '''yield hexdump -C like lines of src, base is the offset of src[0]'''
+    if isinstance(src, str):
+        src = src.encode('latin-1')
+    view = memoryview(src)
+    table = _printable_table(sep)
+    for c in range(0, len(view), length):
+        chars = view[c:c+length]
+        hexstr = chars.hex(' ')
         if len(hexstr) > 24:
-            hexstr = "%s %s" % (hexstr[:24], hexstr[24:])
-        printable = ''.join(["%s" % ((ord(x) <= 127 and FILTER[ord(x)]) or sep) for x in chars]) if type(chars) is str else ''.join(['{}'.format((x <= 127 and FILTER[x]) or sep) for x in chars])
-        lines.append("%08x:  %-*s  |%s|" % (c, length*3, hexstr, printable))
-    return '\n'.join(lines)
+            hexstr = hexstr[:24] + ' ' + hexstr[24:]
+        printable = bytes(chars).translate(table).decode('ascii')
+        yield "%08x:  %-*s  |%s|" % (base + c, length*3, hexstr, printable)
+
+def i2cdump_lines(src, base=0):
+    '''yield lines in the format of `i2cdump`, rows are aligned to 16 bytes'''
+    view = memoryview(src)
+    width = 2 if base + len(view) <= 0x100 else 4
+    yield ' ' * (width + 2) + ' '.join(f'{x:2x}' for x in range(16)) + '    0123456789abcdef'
+    row = base & ~0xf
+    while row < base + len(view):
+        lo = max(row, base) - base
+        hi = min(row + 16, base + len(view)) - base
+        pad = max(base - row, 0)
+        hexstr = '   ' * pad + view[lo:hi].hex(' ') + '   ' * (16 - pad - (hi - lo))
+        printable = ' ' * pad + bytes(view[lo:hi]).translate(I2CDUMP_TABLE).decode('ascii')
+        yield f'{row:0{width}x}: {hexstr.rstrip():<47}    {printable}'
+        row += 16
+
+def hexdump(src, length=16, sep='.'):
+    return '\n'.join(hexdump_lines(src, length, sep))
 
+FORMATS = ['hex', 'i2cdump', 'raw']
 
-class SmbusReader():
-    def __init__(self, bus_no, i2c_addr, force=True):
-        from smbus2 import SMBus
-        self.bus = SMBus(bus_no, force)
-        self.i2c_addr = i2c_addr
+def write_dump(data, fmt='hex', base=0, out=None):
+    '''stream data to out (a text file, stdout by default) in fmt'''
+    out = out or sys.stdout
+    if fmt == 'raw':
+        out.flush()
+        out.buffer.write(data)
+        out.buffer.flush()
+        return
+    lines = i2cdump_lines(data, base) if fmt == 'i2cdump' else hexdump_lines(data, base=base)
+    for line in lines:
+        out.write(line + '\n')
 
-    def __del__(self):
-        self.bus.close()
 
-    def __read_blk(self, offset, length):
-        return self.bus.read_i2c_block_data(self.i2c_addr, offset, length)
+def sweep_bus(bus, addrs, timeout=None, signature=None):
+    '''probe addrs on an opened SmbusBus, return {addr: signature bytes or b''}'''
+    if timeout is not None:
+        bus.set_timeout(timeout)
+    found = dict()
+    for addr in addrs:
+        if not bus.probe(addr):
+            continue
+        found[addr] = b''
+        if signature is not None:
+            try:
+                found[addr] = bytes(bus.read(addr, *signature))
+            except OSError:
+                pass
+    return found
 
-    def read(self, offset, length):
-        BLK_MAX = 32
-        data = []
-        while 0 < length:
-            rd_len = length if length < BLK_MAX else BLK_MAX
-            data.extend(self.__read_blk(offset, rd_len))
-            length -= rd_len
-            offset += rd_len
-        return data
+def sweep(buses, addrs, timeout=None, signature=None, bus_factory=None):
+    '''probe addrs on all buses in parallel (one worker per bus adapter)
 
+    return {bus_no: {addr: signature} or error string}, bus_factory(bus_no)
+    returns an SmbusBus and makes it possible to sweep fake backends
+    '''
+    bus_factory = bus_factory or (lambda bus_no: SmbusBus(bus_no, retries=0))
 
-@click.command()
+    def worker(bus_no):
+        try:
+            with bus_factory(bus_no) as bus:
+                return sweep_bus(bus, addrs, timeout, signature)
+        except OSError as e:
+            return f'{type(e).__name__}: {e}'
+
+    with ThreadPoolExecutor(max_workers=max(1, len(buses))) as pool:
+        return dict(zip(buses, pool.map(worker, buses)))
+
+
+@click.group(cls=DefaultGroup, default_cmd='get')
+def root():
+    """i2c read utilities, `get` is the default command"""
+    pass
+
+@root.command()
 @click.argument('bus_no', type=click.INT)
 @click.argument('i2c_addr', type=click.STRING)
 @click.argument('cmd', type=click.STRING)
 @click.argument('length', type=click.STRING, default='1')
-def main(bus_no, i2c_addr, cmd, length):
-    print(f'read i2c-{bus_no}-{i2c_addr}, cmd({cmd}), length({length})')
+@click.option('--addr-width', '-w', type=click.Choice(['1', '2']), default='1',
+              help='bytes of the offset(cmd), 2 for large eeproms like 24c512')
+@click.option('--format', '-f', 'fmt', type=click.Choice(FORMATS), default='hex',
+              show_default=True, help='output format')
+def get(bus_no, i2c_addr, cmd, length, addr_width, fmt):
+    """read LENGTH bytes from CMD of a device and dump them"""
+    if fmt != 'raw':
+        print(f'read i2c-{bus_no}-{i2c_addr}, cmd({cmd}), length({length})')
     i2c_addr = int(i2c_addr, 0) # str to int, this handle both hex and dec.
     cmd = int(cmd, 0)
     length = int(length, 0)
-    data = bytes(SmbusReader(bus_no, i2c_addr).read(cmd, length))
-    print(hexdump(data))
+    with SmbusReader(bus_no, i2c_addr, addr_width=int(addr_width)) as reader:
+        data = bytes(reader.read(cmd, length))
+    write_dump(data, fmt, base=cmd)
+
+@root.command(name='sweep')
+@click.argument('buses', type=click.STRING)
+@click.argument('i2c_addrs', type=click.STRING, default='0x03-0x77')
+@click.option('--timeout', '-t', type=click.FLOAT, default=None,
+              help='adapter timeout per probe in seconds')
+@click.option('--signature', '-s', type=click.STRING, default=None,
+              help='OFFSET:LENGTH to read from every responder, e.g. 0:8')
+@click.option('--json', 'as_json', is_flag=True, default=False, help='output json')
+def sweep_cmd(buses, i2c_addrs, timeout, signature, as_json):
+    """probe I2C_ADDRS (0x03-0x77 by default) on BUSES, e.g. `sweep 0-40`"""
+    if signature is not None:
+        signature = tuple(int(x, 0) for x in signature.split(':'))
+    result = sweep(parse_int_list(buses), parse_int_list(i2c_addrs), timeout, signature)
+    if as_json:
+        print(json.dumps({bus: res if isinstance(res, str) else {hex(a): sig.hex() for a, sig in res.items()}
+                          for bus, res in result.items()}))
+        return
+    for bus, res in result.items():
+        if isinstance(res, str):
+            print(f'i2c-{bus}: {res}')
+        elif signature is None:
+            print(f'i2c-{bus}: ' + ' '.join(f'{a:02x}' for a in res))
+        else:
+            for addr, sig in res.items():
+                print(f'i2c-{bus} {addr:02x}: {sig.hex(" ")}')
+
+@root.command()
+@click.option('--size', '-s', type=click.INT, default=64 * 1024, show_default=True,
+              help='bytes to dump')
+@click.option('--repeat', '-r', type=click.INT, default=20, show_default=True)
+def bench(size, repeat):
+    """measure hexdump throughput on random data"""
+    data = os.urandom(size)
+    with open(os.devnull, 'w') as null:
+        for fmt in ['hex', 'i2cdump']:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                write_dump(data, fmt, out=null)
+            elapsed = time.perf_counter() - start
+            print(f'{fmt:8s}: {size * repeat / elapsed / 1e6:8.2f} MB/s')
 
 if __name__ == "__main__":
-    main()
+    root()
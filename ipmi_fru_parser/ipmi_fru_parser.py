@@ -1,9 +1,22 @@
 #!/usr/bin/env python3
 
 from tabulate import tabulate
+from datetime import datetime, timedelta
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import threading
+import json
+import mmap
+import os
+import re
+import sys
 import click
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from smbus_reader import SmbusBus, SmbusReader, parse_int_list
+
 ignore_chksum_err = False
+fru_cache = None
 
 def is_checksum_valid(buf, length):
     if length > len(buf):
@@ -12,43 +25,20 @@ def is_checksum_valid(buf, length):
         return sum(buf[0:length]) % 256 == 0
 
 
-class SmbusReader():
-    def __init__(self, bus_no, i2c_addr, force=True):
-        from smbus2 import SMBus
-        self.bus = SMBus(bus_no, force)
-        self.i2c_addr = i2c_addr
-
-    def __del__(self):
-        self.bus.close()
-
-    def __read_blk(self, offset, length):
-        return self.bus.read_i2c_block_data(self.i2c_addr, offset, length)
-
-    def read(self, offset, length):
-        BLK_MAX = 32
-        data = []
-        while 0 < length:
-            rd_len = length if length < BLK_MAX else BLK_MAX
-            data.extend(self.__read_blk(offset, rd_len))
-            length -= rd_len
-            offset += rd_len
-        return data
-
 class CommonHeader():
     """CommonHeader class takes bytes and provides info like dict """
 
     LENGTH = 8
+    AREAS = ['internal', 'chassis', 'board', 'product', 'multirecord']
 
     def __init__(self, buf):
+        self.raw = bytes(buf[0:self.LENGTH])
         self.valid = is_checksum_valid(buf, self.LENGTH)
         if self.is_valid:
             self.data = dict()
             self.data['version'] = buf[0]
-            self.data['internal'] = buf[1] * 8
-            self.data['chassis'] = buf[2] * 8
-            self.data['board'] = buf[3] * 8
-            self.data['product'] = buf[4] * 8
-            self.data['multirecord'] = buf[5] * 8
+            for i, area in enumerate(self.AREAS):
+                self.data[area] = buf[i + 1] * 8
 
     @property
     def is_valid(self):
@@ -59,93 +49,620 @@ class CommonHeader():
         return self.data['product'] if self.is_valid else None
 
 
-
-class ProductInfo():
-    """This class takes types (starts from Product Info Area) and provide specific info"""
-
-    DYNAMIC_FILEDS = ['manufacturer', 'product', 'model', 'version', 'serial', 'asset', 'fru_id']
-    INIT_DYNAMIC_FIELDS_OFFSET = 3
-
-    def parse_fields(self, name, addr):
-        self.info[name + '_addr'] = addr + 1
-        self.info[name + '_len'] = self.buf[addr] & 0x3f
-        return addr + self.info[name + '_len'] + 1
-
-    def __init__(self, buf, base_ofs):
-        self.length = buf[1] * 8
-        self.valid = is_checksum_valid(buf, self.length)
-        if self.is_valid is False:
-            print('ERROR: The product info chksum fail.')
-            return
-
-        self.buf = buf
-        self.info = dict()
-        addr = self.INIT_DYNAMIC_FIELDS_OFFSET + base_ofs
-        for field in self.DYNAMIC_FILEDS:
-            addr = self.parse_fields(field, addr)
+################## type/length field decoding #######################
+
+TL_BINARY = 0
+TL_BCD_PLUS = 1
+TL_6BIT_ASCII = 2
+TL_8BIT = 3
+END_OF_FIELDS = 0xc1
+BCD_PLUS_CHARS = '0123456789 -.???'
+
+def decode_bcd_plus(raw):
+    return ''.join(BCD_PLUS_CHARS[b >> 4] + BCD_PLUS_CHARS[b & 0xf] for b in raw)
+
+def decode_6bit_ascii(raw):
+    '''4 chars are packed in every 3 bytes, LSB first'''
+    val = int.from_bytes(raw, 'little')
+    return ''.join(chr(((val >> (6 * i)) & 0x3f) + 0x20) for i in range(len(raw) * 8 // 6))
+
+def decode_field(type_len, raw):
+    '''decode raw (memoryview) according to the type/length byte'''
+    kind = type_len >> 6
+    if kind == TL_BINARY:
+        return raw.hex()
+    if kind == TL_BCD_PLUS:
+        return decode_bcd_plus(raw)
+    if kind == TL_6BIT_ASCII:
+        return decode_6bit_ascii(raw)
+    return str(raw, 'latin-1')
+
+
+class FruArea():
+    """Base of chassis/board/product info areas.
+
+    Only the type/length bytes are walked (on demand) to locate fields, a field
+    is decoded when it is accessed.
+    """
+
+    NAME = ''
+    FIELDS = []
+    EXTRA_FIELDS = [] # keys of extra_dict()
+    FIXED_LENGTH = 3 # version, length and the first area specific byte
+
+    def __init__(self, view, base_ofs):
+        self.view = view
+        self.base = base_ofs
+        self.length = view[base_ofs + 1] * 8
+        self.valid = is_checksum_valid(view[base_ofs:], self.length)
+        self.end = base_ofs + self.length if self.length else len(view)
+        self._tl_offsets = [] # offsets of type/length bytes walked so far
+        self._next = base_ofs + self.FIXED_LENGTH
 
     @property
     def is_valid(self):
         return self.valid if not ignore_chksum_err else True
 
+    def _tl_offset(self, idx):
+        while len(self._tl_offsets) <= idx:
+            ofs = self._next
+            if ofs >= self.end or self.view[ofs] == END_OF_FIELDS:
+                return None
+            self._tl_offsets.append(ofs)
+            self._next = ofs + 1 + (self.view[ofs] & 0x3f)
+        return self._tl_offsets[idx]
+
+    def _get(self, idx):
+        ''' return addr, len, value of idx-th field, None if it doesn't exist'''
+        ofs = self._tl_offset(idx)
+        if ofs is None:
+            return None
+        length = self.view[ofs] & 0x3f
+        return ofs + 1, length, decode_field(self.view[ofs], self.view[ofs + 1: ofs + 1 + length])
+
     def get_field(self, name):
         ''' return addr_in_hex, len, value of the specified field'''
-        addr = self.info[name + '_addr']
-        len = self.info[name + '_len']
-        val = self.buf[addr: addr + len].decode('utf-8') # might exception here
-        return hex(addr), len, val
+        field = self._get(self.FIELDS.index(name))
+        if field is None:
+            return None, 0, None
+        addr, length, val = field
+        return hex(addr), length, val
+
+    def __getitem__(self, name):
+        return self.get_field(name)[2]
+
+    def custom_fields(self):
+        idx = len(self.FIELDS)
+        while True:
+            field = self._get(idx)
+            if field is None:
+                return
+            yield field[2]
+            idx += 1
+
+    def as_dict(self, fields=None):
+        ''' return {field: value} of given fields, all fields by default'''
+        if self.is_valid is False:
+            return {'error': 'invalid checksum'}
+        res = dict()
+        for f in fields or self.FIELDS:
+            res[f] = self.extra_dict()[f] if f in self.EXTRA_FIELDS else self[f]
+        if fields is None:
+            res.update(self.extra_dict())
+            custom = list(self.custom_fields())
+            if custom:
+                res['custom'] = custom
+        return res
+
+    def extra_dict(self):
+        '''area specific fixed fields'''
+        return {}
 
     def dump(self):
         header = ['field', 'addr', 'len', 'value']
         if self.is_valid is False:
+            print(f'ERROR: The {self.NAME} info chksum fail.')
             return
 
-        print('----- Dump Product Info ----- ')
-        table = []
-        for f in self.DYNAMIC_FILEDS:
-            if f == 'asset': # asset str cannot be decoded in utf-8, skip it.
-                continue
-            info = [f]
-            info.extend(self.get_field(f))
-            table.append(info)
+        print(f'----- Dump {self.NAME.capitalize()} Info ----- ')
+        table = [[f, *self.get_field(f)] for f in self.FIELDS]
+        table += [[k, '', '', v] for k, v in self.extra_dict().items()]
         print(tabulate(table, header, tablefmt='simple', stralign='left'))
 
 
+class ChassisInfo(FruArea):
+    NAME = 'chassis'
+    FIELDS = ['part_number', 'serial']
+    EXTRA_FIELDS = ['type']
+
+    def extra_dict(self):
+        return {'type': self.view[self.base + 2]}
+
+
+class BoardInfo(FruArea):
+    NAME = 'board'
+    FIELDS = ['manufacturer', 'product', 'serial', 'part_number', 'fru_id']
+    EXTRA_FIELDS = ['mfg_date']
+    FIXED_LENGTH = 6 # version, length, language, mfg date/time(3)
+    MFG_DATE_BASE = datetime(1996, 1, 1)
+
+    @property
+    def mfg_date(self):
+        '''manufacture date, None if unspecified'''
+        minutes = int.from_bytes(self.view[self.base + 3: self.base + 6], 'little')
+        return self.MFG_DATE_BASE + timedelta(minutes=minutes) if minutes else None
+
+    def extra_dict(self):
+        date = self.mfg_date
+        return {'mfg_date': date.isoformat() if date else None}
+
+
+class ProductInfo(FruArea):
+    """This class takes types (starts from Product Info Area) and provide specific info"""
+
+    NAME = 'product'
+    FIELDS = ['manufacturer', 'product', 'model', 'version', 'serial', 'asset', 'fru_id']
+    DYNAMIC_FILEDS = FIELDS
+
+
+def _psu_info(r):
+    return {
+        'capacity': int.from_bytes(r[0:2], 'little') & 0xfff, # W
+        'peak_va': int.from_bytes(r[2:4], 'little'),
+        'inrush_current': r[4], # A
+        'inrush_interval': r[5], # ms
+        'input_voltage_range1': [int.from_bytes(r[6:8], 'little') * 10,
+                                 int.from_bytes(r[8:10], 'little') * 10], # mV
+        'input_voltage_range2': [int.from_bytes(r[10:12], 'little') * 10,
+                                 int.from_bytes(r[12:14], 'little') * 10], # mV
+        'input_frequency_range': [r[14], r[15]], # Hz
+        'ac_dropout_tolerance': r[16], # ms
+        'flags': r[17],
+        'holdup_time': r[19] >> 4, # s
+        'peak_wattage': int.from_bytes(r[18:20], 'little') & 0xfff, # W
+        'combined_wattage': r.hex() if len(r) < 23 else
+                            [r[20] >> 4, r[20] & 0xf, int.from_bytes(r[21:23], 'little')],
+    }
+
+def _dc_output(r):
+    return {
+        'output_number': r[0] & 0xf,
+        'standby': bool(r[0] & 0x80),
+        'nominal_voltage': int.from_bytes(r[1:3], 'little', signed=True) * 10, # mV
+        'max_negative_deviation': int.from_bytes(r[3:5], 'little', signed=True) * 10,
+        'max_positive_deviation': int.from_bytes(r[5:7], 'little', signed=True) * 10,
+        'ripple': int.from_bytes(r[7:9], 'little'), # mV
+        'min_current': int.from_bytes(r[9:11], 'little'), # mA
+        'max_current': int.from_bytes(r[11:13], 'little'), # mA
+    }
+
+def _dc_load(r):
+    return {
+        'output_number': r[0] & 0xf,
+        'nominal_voltage': int.from_bytes(r[1:3], 'little', signed=True) * 10, # mV
+        'min_voltage': int.from_bytes(r[3:5], 'little', signed=True) * 10,
+        'max_voltage': int.from_bytes(r[5:7], 'little', signed=True) * 10,
+        'ripple': int.from_bytes(r[7:9], 'little'), # mV
+        'min_current': int.from_bytes(r[9:11], 'little'), # mA
+        'max_current': int.from_bytes(r[11:13], 'little'), # mA
+    }
+
+
+class MultiRecord():
+    """Walks the multirecord area, record data is decoded on demand"""
+
+    HDR_LENGTH = 5
+    # type id: (name, decoder, minimum data length the decoder reads)
+    DECODERS = {0x00: ('psu_info', _psu_info, 20),
+                0x01: ('dc_output', _dc_output, 13),
+                0x02: ('dc_load', _dc_load, 13)}
+
+    def __init__(self, view, base_ofs):
+        self.view = view
+        self.base = base_ofs
+
+    def __iter__(self):
+        ''' yield (type_id, end_of_list, data(memoryview)) of each valid record'''
+        ofs = self.base
+        while ofs + self.HDR_LENGTH <= len(self.view):
+            hdr = self.view[ofs: ofs + self.HDR_LENGTH]
+            if not is_checksum_valid(hdr, self.HDR_LENGTH) and not ignore_chksum_err:
+                return
+            data = self.view[ofs + self.HDR_LENGTH: ofs + self.HDR_LENGTH + hdr[2]]
+            if (sum(data) + hdr[3]) % 256 == 0 or ignore_chksum_err:
+                yield hdr[0], bool(hdr[1] & 0x80), data
+            if hdr[1] & 0x80:
+                return
+            ofs += self.HDR_LENGTH + hdr[2]
+
+    def as_list(self):
+        res = []
+        for type_id, _, data in self:
+            name, decoder, min_len = self.DECODERS.get(type_id, (None, None, 0))
+            rec = {'type': type_id}
+            if decoder is None or len(data) < min_len:
+                rec['data'] = data.hex()
+            else:
+                rec[name] = decoder(data)
+            res.append(rec)
+        return res
+
+
+class Fru():
+    """A FRU image, areas are located by the common header and parsed lazily.
+
+    Keeps a memoryview over buf, use it as a context manager to release the
+    view (e.g. before closing a mmap-ed buf).
+    """
+
+    AREA_CLASSES = {'chassis': ChassisInfo, 'board': BoardInfo, 'product': ProductInfo,
+                    'multirecord': MultiRecord}
+
+    def __init__(self, buf):
+        self.view = memoryview(buf)
+        self.header = CommonHeader(self.view)
+        self._areas = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._areas.clear()
+        self.view.release()
+
+    @property
+    def is_valid(self):
+        return self.header.is_valid
+
+    def area(self, name):
+        '''return the parsed area, None if it doesn't exist'''
+        if name not in self._areas:
+            ofs = self.header.data[name]
+            self._areas[name] = self.AREA_CLASSES[name](self.view, ofs) if ofs else None
+        return self._areas[name]
+
+    @property
+    def chassis(self):
+        return self.area('chassis')
+
+    @property
+    def board(self):
+        return self.area('board')
+
+    @property
+    def product(self):
+        return self.area('product')
+
+    @property
+    def multirecord(self):
+        return self.area('multirecord')
+
+    def as_dict(self, fields=None):
+        '''fields: list of "area.field" (e.g. "product.serial"), all by default'''
+        if self.is_valid is False:
+            return {'error': 'invalid header'}
+        if fields is None:
+            wanted = {name: None for name in self.AREA_CLASSES}
+            res = {'header': self.header.data}
+        else:
+            wanted = dict()
+            for f in fields:
+                name, _, field = f.partition('.')
+                wanted.setdefault(name, []).append(field)
+            res = dict()
+        for name, area_fields in wanted.items():
+            try:
+                area = self.area(name)
+                if area is None:
+                    continue
+                res[name] = area.as_list() if name == 'multirecord' else area.as_dict(area_fields)
+            except IndexError:
+                res[name] = {'error': 'truncated'}
+        return res
+
+
 def parse(data):
-    hdr = CommonHeader(data)
-    if hdr.is_valid is False:
+    fru = Fru(data)
+    if fru.is_valid is False:
         print('ERROR: The Header is not valid')
         return
 
-    prod_info = ProductInfo(data, hdr.product_info_base_offset)
-    prod_info.dump()
+    for name in ['chassis', 'board', 'product']:
+        area = fru.area(name)
+        if area is not None:
+            area.dump()
+
+
+################## eeprom reading #######################
+
+def _put(image, ofs, data):
+    '''copy data into image (bytearray) at ofs, unread gaps are 0xff'''
+    if len(image) < ofs + len(data):
+        image.extend(b'\xff' * (ofs + len(data) - len(image)))
+    image[ofs: ofs + len(data)] = data
+
+
+class FruReader():
+    """Reads a FRU eeprom header first, then only the areas asked for.
+
+    Area sizes come from the length bytes, so nothing beyond the FRU content is
+    read. With a FruCache, a cheap fingerprint (header, area length and checksum
+    bytes) is read instead and the image is served from the cache if unchanged.
+    """
+
+    INFO_AREAS = ['chassis', 'board', 'product']
+
+    def __init__(self, bus, i2c_addr, cache=None):
+        '''bus: an opened SmbusBus'''
+        self.bus_no = bus.bus_no
+        self.i2c_addr = i2c_addr
+        self.cache = cache
+        self.reader = SmbusReader(bus.bus_no, i2c_addr, bus=bus)
+
+    def _read(self, ofs, length):
+        return bytes(self.reader.read(ofs, length)) if length > 0 else b''
+
+    def fingerprint(self, hdr):
+        fp = bytearray(hdr.raw)
+        for name in self.INFO_AREAS:
+            ofs = hdr.data[name]
+            if ofs:
+                length = self._read(ofs + 1, 1)[0] * 8
+                fp += bytes([length]) + self._read(ofs + length - 1, 1)
+        if hdr.data['multirecord']:
+            fp += self._read(hdr.data['multirecord'], MultiRecord.HDR_LENGTH)
+        return fp.hex()
+
+    def _read_area(self, image, name, ofs):
+        if name != 'multirecord':
+            head = self._read(ofs, 2)
+            _put(image, ofs, head)
+            _put(image, ofs + 2, self._read(ofs + 2, head[1] * 8 - 2))
+            return
+        while True:
+            rec_hdr = self._read(ofs, MultiRecord.HDR_LENGTH)
+            _put(image, ofs, rec_hdr)
+            if not is_checksum_valid(rec_hdr, MultiRecord.HDR_LENGTH) and not ignore_chksum_err:
+                return
+            ofs += MultiRecord.HDR_LENGTH
+            _put(image, ofs, self._read(ofs, rec_hdr[2]))
+            if rec_hdr[1] & 0x80:
+                return
+            ofs += rec_hdr[2]
+
+    def read(self, fields=None):
+        '''return the (sparse) image with the areas needed by fields, all by default'''
+        image = bytearray(self._read(0, CommonHeader.LENGTH))
+        hdr = CommonHeader(image)
+        if hdr.is_valid is False:
+            return bytes(image)
+
+        names = {f.partition('.')[0] for f in fields} if fields else \
+                set(self.INFO_AREAS + ['multirecord'])
+        names = {n for n in names if hdr.data[n]}
+        cached_areas = set()
+        if self.cache is not None:
+            fp = self.fingerprint(hdr)
+            cached = self.cache.get(self.bus_no, self.i2c_addr, fp)
+            if cached is not None:
+                image, cached_areas = cached
+                if names <= cached_areas:
+                    return bytes(image)
+
+        for name in sorted(names - cached_areas):
+            self._read_area(image, name, hdr.data[name])
+        if self.cache is not None:
+            self.cache.put(self.bus_no, self.i2c_addr, fp, image, names | cached_areas)
+        return bytes(image)
+
+
+class FruCache():
+    """On-disk cache of FRU images keyed by bus, address and fingerprint"""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.expanduser(cache_dir)
+
+    def _path(self, bus_no, i2c_addr):
+        return os.path.join(self.cache_dir, f'i2c-{bus_no}-{i2c_addr:02x}.json')
+
+    def get(self, bus_no, i2c_addr, fingerprint):
+        '''return (image(bytearray), areas(set)), None if missed'''
+        try:
+            with open(self._path(bus_no, i2c_addr)) as f:
+                ent = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if ent.get('fingerprint') != fingerprint:
+            return None
+        return bytearray.fromhex(ent['image']), set(ent['areas'])
+
+    def put(self, bus_no, i2c_addr, fingerprint, image, areas):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(bus_no, i2c_addr)
+        ent = {'fingerprint': fingerprint, 'areas': sorted(areas), 'image': image.hex()}
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp, 'w') as f:
+            json.dump(ent, f)
+        os.replace(tmp, path)
+
+
+def to_record(data, fields=None):
+    '''parse data and return a dict which can be dumped as json'''
+    with Fru(data) as fru:
+        return fru.as_dict(fields)
+
+
+I2CDUMP_LINE = re.compile(rb'^\s*([0-9a-fA-F]+):\s')
+HEX_BYTE = re.compile(rb'^[0-9a-fA-F]{2}$')
+
+def is_i2cdump_text(head):
+    '''guess from the first bytes of a file whether it is an i2cdump output'''
+    try:
+        head.decode('ascii')
+    except UnicodeDecodeError:
+        return False
+    return any(I2CDUMP_LINE.match(l) for l in head.splitlines())
+
+def parse_i2cdump_text(text):
+    '''i2cdump output (bytes) -> bytes, unreadable bytes ('XX') become 0xff'''
+    buf = bytearray()
+    for line in text.splitlines():
+        m = I2CDUMP_LINE.match(line)
+        if m is None:
+            continue
+        ofs = int(m.group(1), 16)
+        if len(buf) < ofs:
+            buf.extend(b'\xff' * (ofs - len(buf)))
+        for tok in line[m.end():].split()[:16]:
+            if HEX_BYTE.match(tok):
+                buf.append(int(tok, 16))
+            elif tok == b'XX':
+                buf.append(0xff)
+            else:
+                break
+    return bytes(buf)
+
+def parse_file(path, fields=None):
+    '''parse an i2cdump text or a raw binary image, binaries are mmap-ed'''
+    rec = {'file': path}
+    try:
+        with open(path, 'rb') as f:
+            if is_i2cdump_text(f.read(512)):
+                f.seek(0)
+                rec.update(to_record(parse_i2cdump_text(f.read()), fields))
+            elif os.fstat(f.fileno()).st_size == 0:
+                rec['error'] = 'empty file'
+            else:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    rec.update(to_record(data, fields))
+    except (OSError, IndexError, ValueError) as e:
+        rec['error'] = f'{type(e).__name__}: {e}'
+    return rec
+
+def list_files(paths):
+    '''expand directories (recursively) into sorted file paths'''
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                yield os.path.join(dirpath, name)
+
+def _set_ignore_chksum_err(val):
+    global ignore_chksum_err
+    ignore_chksum_err = val
+
+
+def scan_bus(bus_no, addrs, fields, emit):
+    '''read addrs on one bus serially, emit(record) for each device'''
+    try:
+        bus = SmbusBus(bus_no)
+    except OSError as e:
+        for addr in addrs:
+            emit({'bus': bus_no, 'addr': hex(addr), 'error': f'{type(e).__name__}: {e}'})
+        return
+
+    with bus:
+        for addr in addrs:
+            rec = {'bus': bus_no, 'addr': hex(addr)}
+            try:
+                data = FruReader(bus, addr, fru_cache).read(fields)
+            except OSError as e:
+                rec['error'] = f'{type(e).__name__}: {e}'
+            else:
+                rec.update(to_record(data, fields))
+            emit(rec)
+
+
+def _check_fields(ctx, param, value):
+    '''"product.serial,board.mfg_date" -> list, None if not given'''
+    if not value:
+        return None
+    fields = value.split(',')
+    for f in fields:
+        name, _, field = f.partition('.')
+        area = Fru.AREA_CLASSES.get(name)
+        if area is None or area is MultiRecord or field not in area.FIELDS + area.EXTRA_FIELDS:
+            raise click.BadParameter(f'unknown field {f}')
+    return fields
+
+fields_option = click.option('--fields', '-f', callback=_check_fields,
+                             help='comma separated "area.field" to decode, e.g. '
+                                  '"product.serial,board.serial", all by default')
 
 
 """
 TODO:
-# Usage ./xxx.py [--ignore-error] [file i2cdump_output.txt] [i2c bus_no i2c_addr]
-1. add arguments to
-    a. flag that whether take data from i2cdump format
-2. handle the content that doesn't follow standard
+1. handle the content that doesn't follow standard
 """
 
 @click.group()
 @click.option('--ignore-error', '-I', is_flag=True, default=False,
               help='continue parsing if checksum error occurs')
+@click.option('--cache-dir', type=click.STRING, default='~/.cache/ipmi_fru_parser',
+              show_default=True, help='where eeprom images read via i2c are cached')
+@click.option('--no-cache', is_flag=True, default=False,
+              help='always read the whole content from eeprom')
 # ('--shout/--no-shout', default=False)
-def root(ignore_error):
+def root(ignore_error, cache_dir, no_cache):
     """IPMI FRU parser"""
-    global ignore_chksum_err
+    global ignore_chksum_err, fru_cache
     ignore_chksum_err = ignore_error
+    fru_cache = None if no_cache else FruCache(cache_dir)
 
 @root.command(name='i2c')
 @click.argument('bus_no', type=click.INT)
 @click.argument('i2c_addr', type=click.STRING)
 def parse_i2c(bus_no, i2c_addr):
     i2c_addr = int(i2c_addr, 0) # str to int, this handle both hex and dec.
-    data = bytes(SmbusReader(bus_no, i2c_addr).read(0, 128))
+    with SmbusBus(bus_no) as bus:
+        data = FruReader(bus, i2c_addr, fru_cache).read()
     parse(data)
 
+@root.command(name='scan')
+@click.argument('buses', type=click.STRING)
+@click.argument('i2c_addrs', type=click.STRING)
+@fields_option
+def scan(buses, i2c_addrs, fields):
+    """scan BUSES x I2C_ADDRS, e.g. `scan 0-3,7 0x50-0x57`, one json per line
+
+    Buses are read in parallel (one worker per bus), devices on the same bus
+    are read one by one.
+    """
+    buses = parse_int_list(buses)
+    addrs = parse_int_list(i2c_addrs)
+    lock = threading.Lock()
+
+    def emit(rec):
+        with lock:
+            click.echo(json.dumps(rec))
+
+    with ThreadPoolExecutor(max_workers=len(buses)) as pool:
+        futures = [pool.submit(scan_bus, bus, addrs, fields, emit) for bus in buses]
+        for f in futures:
+            f.result()
+
+@root.command(name='file')
+@click.argument('paths', type=click.Path(exists=True), nargs=-1, required=True)
+@click.option('--jobs', '-j', type=click.INT, default=os.cpu_count(), show_default=True,
+              help='number of worker processes')
+@click.option('--output', '-o', type=click.File('w'), default='-',
+              help='jsonl output file, stdout by default')
+@fields_option
+def parse_files(paths, jobs, output, fields):
+    """parse i2cdump text or raw binary files, directories are walked recursively
+
+    One json per line is written to the output in the order of input files.
+    """
+    files = list(list_files(paths))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_set_ignore_chksum_err,
+                             initargs=(ignore_chksum_err,)) as pool:
+        chunksize = max(1, len(files) // (jobs * 4))
+        for rec in pool.map(partial(parse_file, fields=fields), files, chunksize=chunksize):
+            output.write(json.dumps(rec) + '\n')
+
 
 if __name__ == "__main__":
     root()
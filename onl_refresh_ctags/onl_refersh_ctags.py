@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tabulate import tabulate
+import json
+import os
+import subprocess
+import time
+import click
+
+CTAGS_DIRS_SRC_FILE = '/home/ubuntu/sean_upload/onl_ctags_dirs.txt'
+CSCOPE_FILES = 'cscope.files'
+MANIFEST = '.cscope_manifest.json'
+SRC_EXTS = ('.c', '.h', '.cpp')
+
+def is_source(name):
+    '''like `find -iname "*.c" -o -iname "*.h" -o -iname "*.cpp" -o -iname "Makefile"`'''
+    name = name.lower()
+    return name.endswith(SRC_EXTS) or name == 'makefile'
+
+def scan_dir(path):
+    '''return ([(source path, mtime_ns)], [sub dirs]) of one directory'''
+    files, subdirs = [], []
+    try:
+        it = os.scandir(path)
+    except OSError:
+        return files, subdirs
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif is_source(entry.name):
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except OSError: # dangling symlink
+                    mtime = 0
+                files.append((entry.path, mtime))
+    return files, subdirs
+
+def timed_scan_dir(path):
+    '''scan_dir, also returning the seconds it took'''
+    start = time.perf_counter()
+    files, subdirs = scan_dir(path)
+    return files, subdirs, time.perf_counter() - start
+
+def walk_dirs(tops, jobs):
+    '''
+    walk all tops at once, each directory is one scandir task of the pool
+    return ({top: {path: mtime_ns}}, {top: seconds spent in scan_dir})
+    '''
+    found = {top: dict() for top in tops}
+    elapsed = {top: 0.0 for top in tops}
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        pending = {pool.submit(timed_scan_dir, top): top for top in tops}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                top = pending.pop(fut)
+                files, subdirs, seconds = fut.result()
+                found[top].update(files)
+                elapsed[top] += seconds
+                for d in subdirs:
+                    pending[pool.submit(timed_scan_dir, d)] = top
+    return found, elapsed
+
+def read_dirs(fpath):
+    with open(fpath) as f:
+        return [d for d in f.read().split() if d]
+
+def load_manifest(fpath):
+    try:
+        with open(fpath) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+def write_atomic(fpath, text):
+    tmp = fpath + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, fpath)
+
+def read_lines(fpath):
+    try:
+        with open(fpath) as f:
+            return f.read().splitlines()
+    except OSError:
+        return None
+
+
+@click.command()
+@click.option('--dirs-file', type=click.Path(exists=True, dir_okay=False),
+              default=CTAGS_DIRS_SRC_FILE, show_default=True, help='directories to index')
+@click.option('--jobs', '-j', type=click.INT, default=32, show_default=True,
+              help='number of scandir workers')
+@click.option('--force', is_flag=True, default=False, help='rebuild even if nothing changed')
+def main(dirs_file, jobs, force):
+    '''refresh cscope.files and the cscope database in the current dir, incrementally'''
+    tops = read_dirs(dirs_file)
+    found, scan_time = walk_dirs(tops, jobs)
+
+    old = load_manifest(MANIFEST)
+    new = dict()
+    report = []
+    for top in tops:
+        files = found[top]
+        prefix = top.rstrip('/') + '/'
+        old_top = {p: m for p, m in old.items() if p.startswith(prefix)}
+        added = files.keys() - old_top.keys()
+        removed = old_top.keys() - files.keys()
+        modified = [p for p in files.keys() & old_top.keys() if files[p] != old_top[p]]
+        report.append([top, len(files), len(added), len(removed), len(modified),
+                       f'{scan_time[top]:.3f}'])
+        new.update(files)
+
+    # keep the per dir order, sorted so that cscope.files is stable
+    paths = [p for top in tops for p in sorted(found[top])]
+    old_paths = read_lines(CSCOPE_FILES)
+    if old_paths is None or set(old_paths) != set(paths):
+        write_atomic(CSCOPE_FILES, ''.join(p + '\n' for p in paths))
+        files_state = 'rewritten'
+    else:
+        files_state = 'unchanged'
+
+    if not force and new == old and os.path.exists('cscope.out'):
+        rebuild = 'skipped, no source changed'
+    else:
+        # without -u cscope reuses cscope.out and only re-parses changed files
+        start = time.perf_counter()
+        subprocess.run(['cscope', '-Rbq', '-i', CSCOPE_FILES], check=True)
+        rebuild = f'{time.perf_counter() - start:.3f}s'
+        write_atomic(MANIFEST, json.dumps(new))
+
+    print(tabulate(report, ['dir', 'files', 'added', 'removed', 'modified', 'scan(s)'],
+                   tablefmt='simple'))
+    print(f'{CSCOPE_FILES}: {files_state} ({len(paths)} files)')
+    print(f'cscope rebuild: {rebuild}')
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,6 @@
 #!/bin/bash
 
-CTAGS_DIRS_SRC_FILE="/home/ubuntu/sean_upload/onl_ctags_dirs.txt"
-CTAGS_DIRS_INT_FILE="/tmp/onl_ctags_dirs.txt"
-
-sed -e ':a' -e 'N' -e '$!ba' -e 's/\n/ /g'  ${CTAGS_DIRS_SRC_FILE} > ${CTAGS_DIRS_INT_FILE}
-
-CTAGS_DIRS=`cat ${CTAGS_DIRS_INT_FILE}`
-find ${CTAGS_DIRS} -iname "*.c" -o -iname "*.h" -o -iname "*.cpp" -o -iname "Makefile" > cscope.files
-cscope -Rbq -i cscope.files
+# The refresh is done by onl_refersh_ctags.py, which walks the dirs in parallel
+# and only rewrites cscope.files / rebuilds cscope when sources changed.
 
+exec python3 "$(dirname "$(readlink -f "$0")")/onl_refersh_ctags.py" --dirs-file "/home/ubuntu/sean_upload/onl_ctags_dirs.txt" "$@"
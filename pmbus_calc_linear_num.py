@@ -1,15 +1,179 @@
 #!/usr/bin/env python3
 
+import math
+import re
+import sys
 import click
+from default_group import DefaultGroup
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def sign_extend(data, bits):
+    '''two's complement of the low `bits` bits, works on ints and numpy arrays'''
+    sign = 1 << (bits - 1)
+    return ((data & ((1 << bits) - 1)) ^ sign) - sign
 
 def two_complement_to_int(data, valid_bit, mask):
-    valid_data = data & mask
-    is_neg = valid_data >> (valid_bit - 1)
-    return (-(((~valid_data) & mask) + 1)) if is_neg else valid_data
+    return sign_extend(data & mask, valid_bit)
+
+def _is_array(x):
+    return np is not None and isinstance(x, np.ndarray)
+
+def _as_ints(words):
+    '''numpy arrays are widened so that the arithmetic below can't overflow'''
+    return words.astype(np.int64) if _is_array(words) else words
+
+################## decoders, take an int or a numpy array #######################
+
+def decode_linear11(words):
+    w = _as_ints(words)
+    return sign_extend(w & 0x7ff, 11) * 2.0 ** sign_extend(w >> 11, 5)
+
+def decode_linear16(words, vout_mode):
+    '''the exponent is the low 5 bits of VOUT_MODE'''
+    return _as_ints(words) * 2.0 ** sign_extend(vout_mode, 5)
+
+def decode_direct(words, m, b, R):
+    '''X = (Y * 10^-R - b) / m'''
+    return (sign_extend(_as_ints(words), 16) * 10.0 ** -R - b) / m
+
+################## encoders, take a float or a numpy array #######################
+
+def encode_linear11(values):
+    '''pick the smallest exponent which keeps the mantissa in 11 bits'''
+    if _is_array(values):
+        v = values.astype(np.float64)
+        mag = np.abs(v)
+        exp = np.ceil(np.log2(np.where(mag > 0, mag, 1.0) / 1023))
+        exp = np.clip(np.where(mag > 0, exp, -16), -16, 15)
+        man = np.rint(v / 2.0 ** exp)
+        exp = np.where((man > 1023) & (exp < 15), exp + 1, exp)
+        man = np.clip(np.rint(v / 2.0 ** exp), -1024, 1023)
+        return ((exp.astype(np.int64) & 0x1f) << 11) | (man.astype(np.int64) & 0x7ff)
+    exp = -16 if values == 0 else min(max(math.ceil(math.log2(abs(values) / 1023)), -16), 15)
+    if round(values / 2.0 ** exp) > 1023 and exp < 15:
+        exp += 1
+    man = min(max(round(values / 2.0 ** exp), -1024), 1023)
+    return ((exp & 0x1f) << 11) | (man & 0x7ff)
+
+def encode_linear16(values, vout_mode):
+    scaled = values / 2.0 ** sign_extend(vout_mode, 5)
+    if _is_array(values):
+        return np.clip(np.rint(scaled), 0, 0xffff).astype(np.int64)
+    return min(max(round(scaled), 0), 0xffff)
+
+def encode_direct(values, m, b, R):
+    '''Y = (m * X + b) * 10^R'''
+    scaled = (m * values + b) * 10.0 ** R
+    if _is_array(values):
+        return np.clip(np.rint(scaled), -0x8000, 0x7fff).astype(np.int64) & 0xffff
+    return min(max(round(scaled), -0x8000), 0x7fff) & 0xffff
+
+################## batch I/O #######################
+
+ODD_HEX_WORD = re.compile(rb'(?:^|\s)[0-9a-fA-F]{1,3}(?=\s|$)|[0-9a-fA-F]{5,}')
+WHITESPACE = b' \t\r\n'
 
-@click.command()
+def _hex_nibbles():
+    table = np.full(256, 0xff, dtype=np.uint8)
+    for i, c in enumerate(b'0123456789abcdef'):
+        table[c] = i
+        table[ord(chr(c).upper())] = i
+    return table
+
+def _parse_fixed_words(text):
+    '''
+    one 4-digit word and one whitespace per 5 bytes (a typical log), decoded
+    with numpy at once, return None for any other layout
+    '''
+    if text and text[-1:] not in (b' ', b'\n'):
+        text += b'\n'
+    if len(text) % 5:
+        return None
+    cols = np.frombuffer(text, dtype=np.uint8).reshape(-1, 5)
+    nib = _hex_nibbles()[cols[:, :4]].astype(np.uint16)
+    if (nib == 0xff).any() or not np.isin(cols[:, 4], np.frombuffer(WHITESPACE, np.uint8)).all():
+        return None
+    return (nib[:, 0] << 12) | (nib[:, 1] << 8) | (nib[:, 2] << 4) | nib[:, 3]
+
+def parse_hex_words(text):
+    '''whitespace separated hex words (bytes) -> numpy uint16 array or list'''
+    text = text.replace(b'0x', b'').replace(b'0X', b'')
+    if np is None:
+        return [int(w, 16) for w in text.split()]
+    words = _parse_fixed_words(text)
+    if words is not None:
+        return words
+    if ODD_HEX_WORD.search(text) is None:
+        return np.frombuffer(bytes.fromhex(text.decode('ascii')), dtype='>u2')
+    return np.array([int(w, 16) for w in text.split()], dtype=np.uint16)
+
+def read_words(files, binary):
+    '''read words from files ('-' is stdin), binary files are little-endian u16'''
+    chunks = []
+    for fpath in files or ['-']:
+        with click.open_file(fpath, 'rb') as f:
+            data = f.read()
+        if binary:
+            chunks.append(np.frombuffer(data, dtype='<u2') if np is not None else
+                          [int.from_bytes(data[i:i+2], 'little') for i in range(0, len(data) - 1, 2)])
+        else:
+            chunks.append(parse_hex_words(data))
+    if np is not None:
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.uint16)
+    return [w for c in chunks for w in c]
+
+def read_values(files):
+    text = b' '.join(click.open_file(f, 'rb').read() for f in files or ['-'])
+    if np is not None:
+        return np.array(text.split(), dtype=np.float64)
+    return [float(v) for v in text.split()]
+
+def _apply(func, data, *args):
+    '''call func on a numpy array at once, or on each item of a list'''
+    if _is_array(data):
+        return func(data, *args)
+    return [func(d, *args) for d in data]
+
+def write_lines(fmt, data, chunk=1 << 20):
+    '''write fmt % item of each item to stdout, formatted a chunk at a time by
+    one % on a repeated fmt instead of a python loop per item'''
+    for i in range(0, len(data), chunk):
+        part = data[i: i + chunk]
+        part = part.tolist() if _is_array(part) else part
+        sys.stdout.write((fmt * len(part)) % tuple(part))
+
+FORMATS = ['linear11', 'linear16', 'direct']
+
+def format_options(func):
+    func = click.option('--format', '-f', 'fmt', type=click.Choice(FORMATS), default='linear11',
+                        show_default=True)(func)
+    func = click.option('--vout-mode', type=click.STRING, default='0',
+                        help='VOUT_MODE value for linear16')(func)
+    func = click.option('-m', type=click.FLOAT, default=1.0, help='direct format coefficient m')(func)
+    func = click.option('-b', type=click.FLOAT, default=0.0, help='direct format coefficient b')(func)
+    func = click.option('-R', 'R', type=click.INT, default=0, help='direct format coefficient R')(func)
+    return func
+
+def _format_args(fmt, vout_mode, m, b, R):
+    if fmt == 'linear11':
+        return ()
+    if fmt == 'linear16':
+        return (int(vout_mode, 0),)
+    return (m, b, R)
+
+
+@click.group(cls=DefaultGroup, default_cmd='calc')
+def root():
+    '''PMBus number conversion, `calc` is the default command'''
+    pass
+
+@root.command()
 @click.argument('hex_str', type=click.STRING)
-def main(hex_str):
+def calc(hex_str):
     '''convert hex string into linear num according to PMBus spec'''
     val = int(hex_str, 16)
     multiplier = 1000
@@ -19,6 +183,37 @@ def main(hex_str):
     result = int(mantissa * (2 ** exponent) * multiplier)
     click.echo(f'result = {result}')
 
+@root.command()
+@click.argument('files', type=click.Path(allow_dash=True), nargs=-1)
+@click.option('--binary', is_flag=True, default=False,
+              help='inputs are raw little-endian 16-bit words')
+@click.option('--output', '-o', type=click.STRING, default=None,
+              help='save decoded values as .npy instead of printing them')
+@format_options
+def decode(files, binary, output, fmt, vout_mode, m, b, R):
+    '''decode hex words from FILES (stdin by default), one value per line'''
+    words = read_words(files, binary)
+    func = {'linear11': decode_linear11, 'linear16': decode_linear16,
+            'direct': decode_direct}[fmt]
+    values = _apply(func, words, *_format_args(fmt, vout_mode, m, b, R))
+    if output is not None:
+        if np is None:
+            raise click.UsageError('--output needs numpy')
+        np.save(output, values)
+        return
+    write_lines('%g\n', values)
+
+@root.command()
+@click.argument('files', type=click.Path(allow_dash=True), nargs=-1)
+@format_options
+def encode(files, fmt, vout_mode, m, b, R):
+    '''encode values from FILES (stdin by default) into hex words'''
+    values = read_values(files)
+    func = {'linear11': encode_linear11, 'linear16': encode_linear16,
+            'direct': encode_direct}[fmt]
+    words = _apply(func, values, *_format_args(fmt, vout_mode, m, b, R))
+    write_lines('%04x\n', words)
+
 
 if __name__ == "__main__":
-    main()
+    root()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+from array import array
+from functools import partial
+from tabulate import tabulate
+import heapq
+import json
+import math
+import threading
+import time
+import click
+from pmbus_calc_linear_num import decode_linear11, decode_linear16, decode_direct
+from smbus_reader import SmbusBus
+
+"""
+Register map (json) example:
+{
+  "devices": [
+    {"name": "psu1", "bus": 10, "addr": "0x58",
+     "registers": [
+       {"name": "READ_VIN",  "cmd": "0x88", "rate": 10},
+       {"name": "READ_VOUT", "cmd": "0x8b", "rate": 50, "format": "linear16", "vout_mode": "0x17"},
+       {"name": "READ_IOUT", "cmd": "0x8c", "rate": 50, "format": "direct", "m": 1, "b": 0, "R": 2}
+     ]}
+  ]
+}
+"rate" is in Hz, "format" is linear11 by default, "raw" keeps the word as is.
+"""
+
+class RingBuffer():
+    """Fixed-size ring of (timestamp, value) backed by two array('d')"""
+
+    def __init__(self, size):
+        self.size = size
+        self.ts = array('d', bytes(8 * size))
+        self.val = array('d', bytes(8 * size))
+        self.next = 0
+        self.count = 0 # total appended, might be more than size
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, ts, val):
+        self.ts[self.next] = ts
+        self.val[self.next] = val
+        self.next = (self.next + 1) % self.size
+        self.count += 1
+
+    def items(self):
+        '''yield (timestamp, value) from the oldest'''
+        start = self.next if self.count > self.size else 0
+        for i in range(len(self)):
+            j = (start + i) % self.size
+            yield self.ts[j], self.val[j]
+
+
+class Register():
+    """A register of a device to sample, with its samples and running stats"""
+
+    DECODERS = {
+        'linear11': lambda reg: decode_linear11,
+        'linear16': lambda reg: partial(decode_linear16, vout_mode=int(str(reg['vout_mode']), 0)),
+        'direct': lambda reg: partial(decode_direct, m=reg['m'], b=reg['b'], R=reg['R']),
+        'raw': lambda reg: float,
+    }
+
+    def __init__(self, device, addr, desc, buf_size):
+        self.device = device
+        self.addr = addr
+        self.name = desc['name']
+        self.cmd = int(str(desc['cmd']), 0)
+        self.period = 1.0 / float(desc.get('rate', 1))
+        self.decode = self.DECODERS[desc.get('format', 'linear11')](desc)
+        self.buf = RingBuffer(buf_size)
+        self.errors = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.0
+
+    def add(self, ts, word):
+        val = self.decode(word)
+        self.buf.append(ts, val)
+        self.min = min(self.min, val)
+        self.max = max(self.max, val)
+        self.sum += val
+
+    def summary(self):
+        n = self.buf.count
+        return [self.device, self.name, n, self.errors,
+                self.min if n else None, self.max if n else None, self.sum / n if n else None]
+
+
+class Poller():
+    """Samples registers at their own rates, one thread per bus.
+
+    Registers of a bus which are due at the same time are read as one batch
+    while holding the bus lock. bus_factory(bus_no) returns an SmbusBus.
+    """
+
+    SUMMARY_HEADER = ['device', 'register', 'samples', 'errors', 'min', 'max', 'mean']
+
+    def __init__(self, config, buf_size=4096, bus_factory=None):
+        self.bus_factory = bus_factory or SmbusBus
+        self.regs_by_bus = dict()
+        for dev in config['devices']:
+            addr = int(str(dev['addr']), 0)
+            regs = self.regs_by_bus.setdefault(int(dev['bus']), [])
+            regs.extend(Register(dev['name'], addr, r, buf_size) for r in dev['registers'])
+        self.stop_event = threading.Event()
+
+    @property
+    def registers(self):
+        return [reg for regs in self.regs_by_bus.values() for reg in regs]
+
+    def _poll_bus(self, bus_no, regs, deadline):
+        with self.bus_factory(bus_no) as bus:
+            start = time.monotonic()
+            due = [(start, i) for i in range(len(regs))]
+            heapq.heapify(due)
+            while not self.stop_event.is_set():
+                wait = min(due[0][0], deadline) - time.monotonic()
+                if wait > 0 and self.stop_event.wait(wait):
+                    break
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                batch = []
+                while due and due[0][0] <= now:
+                    batch.append(heapq.heappop(due))
+                ts = time.time()
+                with bus.lock:
+                    for t, i in batch:
+                        reg = regs[i]
+                        try:
+                            word = bus.read(reg.addr, reg.cmd, 2)
+                        except OSError:
+                            reg.errors += 1
+                        else:
+                            reg.add(ts, int.from_bytes(word, 'little'))
+                for t, i in batch:
+                    # skip missed slots instead of bursting to catch up
+                    period = regs[i].period
+                    heapq.heappush(due, (t + period * max(1, math.ceil((now - t) / period)), i))
+
+    def run(self, duration):
+        '''poll for duration seconds (or until stop()), return elapsed seconds'''
+        start = time.monotonic()
+        deadline = start + duration
+        threads = [threading.Thread(target=self._poll_bus, args=(bus_no, regs, deadline))
+                   for bus_no, regs in self.regs_by_bus.items()]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                t.join()
+        except KeyboardInterrupt:
+            self.stop()
+            for t in threads:
+                t.join()
+        return time.monotonic() - start
+
+    def stop(self):
+        self.stop_event.set()
+
+    def summary(self):
+        return [reg.summary() for reg in self.registers]
+
+    def export(self, f, fmt):
+        '''write buffered samples to a text file in csv or jsonl'''
+        if fmt == 'csv':
+            f.write('timestamp,device,register,value\n')
+        for reg in self.registers:
+            for ts, val in reg.buf.items():
+                if fmt == 'csv':
+                    f.write(f'{ts:.6f},{reg.device},{reg.name},{val:g}\n')
+                else:
+                    f.write(json.dumps({'ts': round(ts, 6), 'device': reg.device,
+                                        'register': reg.name, 'value': val}) + '\n')
+
+
+@click.command()
+@click.argument('config', type=click.File('r'))
+@click.option('--duration', '-d', type=click.FLOAT, default=10, show_default=True,
+              help='seconds to poll, Ctrl-C stops earlier')
+@click.option('--size', '-s', type=click.INT, default=4096, show_default=True,
+              help='samples kept per register')
+@click.option('--output', '-o', type=click.File('w'), default=None,
+              help='export samples to this file')
+@click.option('--format', '-f', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv',
+              show_default=True, help='format of the exported samples')
+def main(config, duration, size, output, fmt):
+    '''poll PMBus registers described in CONFIG (json) and summarize them'''
+    poller = Poller(json.load(config), size)
+    elapsed = poller.run(duration)
+    print(f'polled {elapsed:.2f}s')
+    print(tabulate(poller.summary(), Poller.SUMMARY_HEADER, tablefmt='simple', floatfmt='.4g'))
+    if output is not None:
+        poller.export(output, fmt)
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,196 @@
 #!/usr/bin/env python3
+from concurrent.futures import ProcessPoolExecutor
 import click
+import difflib
+import io
 import os
+import re
+import shutil
+import tempfile
+import tokenize
 
-def is_next_to_open_parenth(line, idx):
-    for i in range(idx, len(line)):
-        if line[i] == ' ':
+STMT_START = {tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT, tokenize.ENCODING}
+NON_CODE = {tokenize.COMMENT, tokenize.NL}
+ARG_START_OPS = {'>>', '-', '+', '~', '[', '{', '`'}
+PRINT_FUNCTION = re.compile(r'^from\s+__future__\s+import\s+.*\bprint_function\b', re.M)
+
+def _is_stmt_end(tok, depth):
+    return (tok.type in (tokenize.NEWLINE, tokenize.ENDMARKER) or
+            (depth == 0 and tok.type == tokenize.OP and tok.string == ';'))
+
+def _is_arg_start(tok):
+    if tok.type == tokenize.OP:
+        return tok.string in ARG_START_OPS
+    return True
+
+def _depth_change(tok):
+    if tok.type != tokenize.OP:
+        return 0
+    return (tok.string in '([{') - (tok.string in ')]}')
+
+def _after_parens(code, i):
+    '''token after the ')' which closes the '(' at code[i]'''
+    depth = 0
+    for j in range(i, len(code)):
+        depth += _depth_change(code[j])
+        if depth == 0:
+            return code[j + 1] # there is always the ENDMARKER
+    return code[-1]
+
+def find_print_stmts(tokens):
+    '''
+    yield (print token, [argument tokens]) of python2 print statements, i.e.
+    `print` starting a statement and not followed by anything which can't
+    start an expression (e.g. `print = f`) or by one parenthesized group
+    only (kept as is, like before). `print (a), b` is a statement.
+    '''
+    code = []
+    for t in tokens:
+        if t.type == tokenize.ERRORTOKEN:
+            if t.string.isspace():
+                continue
+            if t.string != '`': # python2 repr backticks are fine
+                raise tokenize.TokenError(f'unexpected {t.string!r} at line {t.start[0]}')
+        if t.type not in NON_CODE:
+            code.append(t)
+    depth = 0
+    for i, tok in enumerate(code):
+        prev = code[i - 1] if i else None
+        if (tok.type == tokenize.NAME and tok.string == 'print' and depth == 0 and
+                (prev is None or prev.type in STMT_START or
+                 (prev.type == tokenize.OP and prev.string in (':', ';')))):
+            nxt = code[i + 1]
+            if (_is_stmt_end(nxt, 0) or _is_arg_start(nxt) or
+                    (nxt.string == '(' and not _is_stmt_end(_after_parens(code, i + 1), 0))):
+                args = []
+                d = 0
+                for t in code[i + 1:]:
+                    if _is_stmt_end(t, d):
+                        break
+                    d += _depth_change(t)
+                    args.append(t)
+                yield tok, args
+        depth += _depth_change(tok)
+
+def _split_at_comma(tokens):
+    '''split tokens at the first top-level ',' -> (before, after or None)'''
+    depth = 0
+    for i, t in enumerate(tokens):
+        if depth == 0 and t.type == tokenize.OP and t.string == ',':
+            return tokens[:i], tokens[i + 1:]
+        depth += _depth_change(t)
+    return tokens, None
+
+def convert_source(text):
+    '''rewrite print statements of python2 source text, return (text, count)'''
+    lines = io.StringIO(text).readlines()
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+    ofs = lambda pos: starts[pos[0] - 1] + pos[1]
+    src = lambda toks: text[ofs(toks[0].start): ofs(toks[-1].end)]
+
+    edits = []
+    for tok, args in find_print_stmts(tokenize.generate_tokens(io.StringIO(text).readline)):
+        stmt_end = ofs((args or [tok])[-1].end)
+        fobj = None
+        if args and args[0].string == '>>':
+            fobj, args = _split_at_comma(args[1:])
+            args = args or []
+        parts = []
+        if args and args[-1].type == tokenize.OP and args[-1].string == ',':
+            # trailing comma, no newline
+            args = args[:-1]
+            parts.append("end=' '")
+        if args:
+            parts.insert(0, src(args))
+        if fobj:
+            parts.append(f'file={src(fobj)}')
+        edits.append((ofs(tok.start), stmt_end, 'print(' + ', '.join(parts) + ')'))
+    for start, end, repl in reversed(edits):
+        text = text[:start] + repl + text[end:]
+    return text, len(edits)
+
+def write_atomic(fpath, data):
+    '''replace fpath by data via a temp file in the same dir, keep the file mode'''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fpath) or '.',
+                               prefix='.' + os.path.basename(fpath) + '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        shutil.copymode(fpath, tmp)
+        os.replace(tmp, fpath)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def correct_print(fpath, dry_run=False):
+    '''
+    convert print statements of fpath in place, return (fpath, status, count, diff)
+    status is 'skipped' (no print at all), 'unchanged', 'changed' or an error
+    message, diff is the unified diff in dry run
+    '''
+    with open(fpath, 'rb') as f:
+        data = f.read()
+    if b'print' not in data:
+        return fpath, 'skipped', 0, None
+    try:
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+        text = data.decode(encoding)
+        if PRINT_FUNCTION.search(text):
+            return fpath, 'unchanged', 0, None
+        new_text, count = convert_source(text)
+    except (SyntaxError, UnicodeDecodeError, tokenize.TokenError) as e:
+        return fpath, f'{type(e).__name__}: {e}', 0, None
+    if count == 0:
+        return fpath, 'unchanged', 0, None
+    if dry_run:
+        diff = ''.join(difflib.unified_diff(text.splitlines(True), new_text.splitlines(True),
+                                            fpath, fpath))
+        return fpath, 'changed', count, diff
+    write_atomic(fpath, new_text.encode(encoding))
+    return fpath, 'changed', count, None
+
+def list_py_files(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
             continue
-        if line[i] == '(':
-            return True
-        else:
-            return False
-
-def correct_print(fpath):
-    fpath_out = fpath + '_out'
-    with open(fpath, 'r') as fi:
-        with open(fpath_out, 'w') as fo:
-            for line in fi:
-                idx = line.find('print')
-                if idx==-1:
-                    fo.write(line)
-                    continue
-                # deal with 'print'
-                idx += len('print')
-                if is_next_to_open_parenth(line, idx):
-                    fo.write(line)
-                    continue
-                # need to insert parenthese
-                line_out = line[:idx] + '(' + line[idx:-1] + ')' + line[-1]
-                fo.write(line_out)
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith('.py'):
+                    yield os.path.join(dirpath, name)
 
 @click.command()
-@click.argument('filepath', type=click.STRING)
-def main(filepath):
-    if not os.path.exists(filepath):
-        click.echo(f'invalid file path: {filepath}')
-        return
-    correct_print(filepath)
+@click.argument('paths', type=click.STRING, nargs=-1, required=True)
+@click.option('--dry-run', '-n', is_flag=True, default=False,
+              help='print diffs instead of writing files')
+@click.option('--jobs', '-j', type=click.INT, default=os.cpu_count(), show_default=True,
+              help='number of worker processes')
+def main(paths, dry_run, jobs):
+    '''convert python2 print statements in PATHS (files or dirs of .py files) in place'''
+    for path in paths:
+        if not os.path.exists(path):
+            click.echo(f'invalid file path: {path}')
+            return
+    files = list(list_py_files(paths))
+    stats = {'skipped': 0, 'unchanged': 0, 'changed': 0, 'error': 0}
+    prints = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for fpath, status, count, diff in pool.map(correct_print, files, [dry_run] * len(files),
+                                                   chunksize=16):
+            if status not in stats:
+                click.echo(f'{fpath}: {status}', err=True)
+                status = 'error'
+            elif status == 'changed':
+                click.echo(diff if dry_run else f'{fpath}: {count} prints converted', nl=not dry_run)
+            stats[status] += 1
+            prints += count
+    verb = 'would change' if dry_run else 'changed'
+    click.echo(f'{len(files)} files: {stats["changed"]} {verb} ({prints} prints), '
+               f'{stats["unchanged"]} unchanged, {stats["skipped"]} skipped without print, '
+               f'{stats["error"]} errors', err=True)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,183 @@
+'''SMBus/I2C reading shared by i2cget.py and ipmi_fru_parser.
+
+Large reads are issued as combined (offset write + read) i2c_rdwr transfers,
+several of them per ioctl, straight into a preallocated bytearray. Adapters
+without plain I2C support, or which reject such long messages (e.g. iProc
+allows 255 bytes per read), fall back to 32-byte SMBus block reads.
+'''
+
+import ctypes
+import errno
+import fcntl
+import threading
+import time
+
+I2C_TIMEOUT = 0x0702
+I2C_FUNC_I2C = 0x00000001
+I2C_M_RD = 0x0001
+I2C_RDRW_IOCTL_MAX_MSGS = 42
+TRANSIENT_ERRNOS = {errno.EREMOTEIO, errno.EAGAIN, errno.ETIMEDOUT, errno.EIO}
+# i2c_rdwr transfers the adapter can't do, block reads still work
+UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.EINVAL}
+
+_bus_locks = dict()
+_bus_locks_guard = threading.Lock()
+
+def parse_int_list(spec):
+    '''"0-3,7" or "0x50-0x57" -> [ints]'''
+    res = []
+    for item in spec.split(','):
+        lo, _, hi = item.strip().partition('-')
+        lo = int(lo, 0)
+        hi = int(hi, 0) if hi else lo
+        res.extend(range(lo, hi + 1))
+    return res
+
+def bus_lock(bus_no):
+    '''return the lock which serializes transfers on bus_no in this process'''
+    with _bus_locks_guard:
+        return _bus_locks.setdefault(bus_no, threading.RLock())
+
+
+class SmbusBus():
+    """An opened i2c bus which can be shared by threads, use it with `with`.
+
+    smbus is an SMBus-like object, /dev/i2c-<bus_no> is opened by default.
+    """
+
+    BLK_MAX = 32
+
+    def __init__(self, bus_no, force=True, retries=2, retry_delay=0.001, chunk_size=4096,
+                 smbus=None):
+        if smbus is None:
+            from smbus2 import SMBus
+            smbus = SMBus(bus_no, force)
+        self.bus_no = bus_no
+        self.bus = smbus
+        self.lock = bus_lock(bus_no)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.chunk_size = chunk_size
+        self.use_rdwr = bool(int(getattr(smbus, 'funcs', 0)) & I2C_FUNC_I2C)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.bus.close()
+
+    def set_timeout(self, seconds):
+        '''set the adapter timeout (in 10ms units), ignored by fake backends'''
+        fd = getattr(self.bus, 'fd', None)
+        if fd is not None:
+            fcntl.ioctl(fd, I2C_TIMEOUT, max(1, round(seconds * 100)))
+
+    def probe(self, i2c_addr):
+        '''return True if i2c_addr acks a read byte (like `i2cdetect -r`)'''
+        with self.lock:
+            try:
+                self.bus.read_byte(i2c_addr)
+            except OSError:
+                return False
+        return True
+
+    def _retry(self, func, *args):
+        '''call func, retry on transient errors (e.g. NACK)'''
+        for i in range(self.retries + 1):
+            try:
+                return func(*args)
+            except OSError as e:
+                if e.errno not in TRANSIENT_ERRNOS or i == self.retries:
+                    raise
+                time.sleep(self.retry_delay)
+
+    def _read_rdwr(self, i2c_addr, offset, buf, addr_width):
+        from smbus2 import i2c_msg
+        mask = (1 << (8 * addr_width)) - 1
+        msgs = []
+        for ofs in range(0, len(buf), self.chunk_size):
+            length = min(self.chunk_size, len(buf) - ofs)
+            dest = (ctypes.c_char * length).from_buffer(buf, ofs)
+            msgs.append(i2c_msg.write(i2c_addr, ((offset + ofs) & mask).to_bytes(addr_width, 'big')))
+            msgs.append(i2c_msg(addr=i2c_addr, flags=I2C_M_RD, len=length,
+                                buf=ctypes.cast(dest, ctypes.POINTER(ctypes.c_char))))
+        for i in range(0, len(msgs), I2C_RDRW_IOCTL_MAX_MSGS):
+            self._retry(self.bus.i2c_rdwr, *msgs[i: i + I2C_RDRW_IOCTL_MAX_MSGS])
+
+    def _read_seq(self, i2c_addr, offset, buf):
+        '''
+        set the 2-byte address pointer, then sequential (current address) reads.
+        A failed read might have advanced the pointer already, so the pointer is
+        set again for the rest of the range before retrying.
+        '''
+        i = 0
+        errors = 0
+        pointer_ok = False
+        while i < len(buf):
+            try:
+                if not pointer_ok:
+                    ofs = offset + i
+                    self.bus.write_byte_data(i2c_addr, (ofs >> 8) & 0xff, ofs & 0xff)
+                    pointer_ok = True
+                buf[i] = self.bus.read_byte(i2c_addr)
+            except OSError as e:
+                if e.errno not in TRANSIENT_ERRNOS or errors == self.retries:
+                    raise
+                errors += 1
+                pointer_ok = False
+                time.sleep(self.retry_delay)
+                continue
+            i += 1
+            errors = 0
+
+    def _read_blk(self, i2c_addr, offset, buf, addr_width):
+        if addr_width == 2:
+            self._read_seq(i2c_addr, offset, buf)
+            return
+        for ofs in range(0, len(buf), self.BLK_MAX):
+            length = min(self.BLK_MAX, len(buf) - ofs)
+            buf[ofs: ofs + length] = self._retry(self.bus.read_i2c_block_data, i2c_addr,
+                                                 (offset + ofs) & 0xff, length)
+
+    def read(self, i2c_addr, offset, length, addr_width=1):
+        '''read length bytes from offset (1 or 2 bytes wide), return bytearray'''
+        buf = bytearray(length)
+        if length == 0:
+            return buf
+        with self.lock:
+            if self.use_rdwr:
+                try:
+                    self._read_rdwr(i2c_addr, offset, buf, addr_width)
+                    return buf
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRNOS:
+                        raise
+                    self.use_rdwr = False
+            self._read_blk(i2c_addr, offset, buf, addr_width)
+        return buf
+
+
+class SmbusReader():
+    """Reads one device, through a shared SmbusBus if given, use it with `with`."""
+
+    def __init__(self, bus_no, i2c_addr, force=True, bus=None, addr_width=1):
+        self._own_bus = bus is None
+        self.bus = SmbusBus(bus_no, force) if bus is None else bus
+        self.i2c_addr = i2c_addr
+        self.addr_width = addr_width
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._own_bus:
+            self.bus.close()
+
+    def read(self, offset, length):
+        return self.bus.read(self.i2c_addr, offset, length, self.addr_width)
@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
 
+from array import array
+from tabulate import tabulate
 import json
+import math
+import sys
+import time
+import click
 
 def _filter_and_reorder_thermals(thermals, orders):
     name_idx = {th.get_name() : i for i, th in enumerate(thermals)}
@@ -49,6 +55,222 @@ def dump_thermal_thresholds_api2():
         }
     print(json.dumps(output, indent=4))
 
+################## sampler #######################
+
+# same keys as the dump above, in the order of the levels they trigger
+THRESHOLDS = [('warning_lower', 'get_low_warning_threshold'),
+              ('warning_upper', 'get_high_warning_threshold'),
+              ('error', 'get_high_threshold'),
+              ('shutdown', 'get_high_critical_threshold')]
+LEVELS = ['ok', 'warning_lower', 'warning', 'error', 'shutdown']
+
+def _read(thermal, func):
+    '''float result of thermal.func(), nan if it's None or fails'''
+    try:
+        val = getattr(thermal, func)()
+        return math.nan if val is None else float(val)
+    except Exception:
+        return math.nan
+
+def _level(temp, lo, warn, err, crit):
+    '''index in LEVELS, comparisons with nan (unknown) are False'''
+    if temp >= crit:
+        return 4
+    if temp >= err:
+        return 3
+    if temp >= warn:
+        return 2
+    if temp <= lo:
+        return 1
+    return 0
+
+
+class ThermalSampler():
+    """Samples temperatures and thresholds of thermals at a fixed rate.
+
+    Samples go into rings of array('d'), one per sensor and value. Every batch
+    cycles the new samples are evaluated against their thresholds sensor by
+    sensor, which updates the stats and returns the rows to output.
+    """
+
+    def __init__(self, thermals, rate, size=4096, batch=None):
+        self.thermals = thermals
+        self.names = [th.get_name() for th in thermals]
+        self.period = 1.0 / rate
+        self.batch = batch or max(1, int(rate))
+        self.size = max(size, self.batch)
+        n = len(thermals)
+        ring = lambda: array('d', bytes(8 * self.size))
+        self.ts = ring()
+        self.overhead = ring() # seconds spent reading in each cycle
+        self.temp = [ring() for _ in range(n)]
+        self.thres = [[ring() for _ in range(n)] for _ in THRESHOLDS] # [threshold][sensor]
+        self.count = 0
+        self.evaluated = 0
+        self.missed = 0
+        self.min = [math.inf] * n
+        self.max = [-math.inf] * n
+        self.sum = [0.0] * n
+        self.samples = [0] * n
+        self.level_counts = [[0] * len(LEVELS) for _ in range(n)]
+
+    def sample(self):
+        i = self.count % self.size
+        start = time.perf_counter()
+        self.ts[i] = time.time()
+        for s, th in enumerate(self.thermals):
+            self.temp[s][i] = _read(th, 'get_temperature')
+            for k, (_, func) in enumerate(THRESHOLDS):
+                self.thres[k][s][i] = _read(th, func)
+        self.overhead[i] = time.perf_counter() - start
+        self.count += 1
+
+    def _ranges(self, first, last):
+        '''ring index ranges of cycles [first, last)'''
+        a, b = first % self.size, (last - 1) % self.size + 1
+        return [(a, b)] if a < b else [(a, self.size), (0, b)]
+
+    def evaluate(self):
+        '''
+        evaluate cycles since the last call, return [(ts, temps, levels, thresholds)]
+        where thresholds is [per sensor (lo, warn, err, crit)]
+        '''
+        if self.evaluated == self.count:
+            return []
+        ranges = self._ranges(self.evaluated, self.count)
+        self.evaluated = self.count
+        ts = [t for a, b in ranges for t in self.ts[a:b]]
+        temps, levels, thres = [], [], []
+        for s in range(len(self.thermals)):
+            temp = [t for a, b in ranges for t in self.temp[s][a:b]]
+            limits = list(zip(*([v for a, b in ranges for v in self.thres[k][s][a:b]]
+                                for k in range(len(THRESHOLDS)))))
+            level = [_level(t, *lim) for t, lim in zip(temp, limits)]
+            valid = [t for t in temp if not math.isnan(t)]
+            if valid:
+                self.min[s] = min(self.min[s], min(valid))
+                self.max[s] = max(self.max[s], max(valid))
+                self.sum[s] += sum(valid)
+                self.samples[s] += len(valid)
+            for lv in level:
+                self.level_counts[s][lv] += 1
+            temps.append(temp)
+            levels.append(level)
+            thres.append(limits)
+        return list(zip(ts, zip(*temps), zip(*levels), zip(*thres)))
+
+    def run(self, duration, emit):
+        '''sample for duration seconds (or until Ctrl-C), emit(rows) every batch'''
+        next_t = time.monotonic()
+        deadline = next_t + duration
+        try:
+            while time.monotonic() < deadline:
+                self.sample()
+                if self.count - self.evaluated >= self.batch:
+                    emit(self.evaluate())
+                next_t += self.period
+                delay = next_t - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # late, skip the missed slots instead of bursting
+                    self.missed += 1
+                    next_t = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        emit(self.evaluate())
+
+    def stats(self):
+        rows = []
+        for s, name in enumerate(self.names):
+            n = self.samples[s]
+            rows.append({'sensor': name, 'samples': n,
+                         'min': self.min[s] if n else None, 'max': self.max[s] if n else None,
+                         'mean': round(self.sum[s] / n, 3) if n else None,
+                         **{lv: self.level_counts[s][i] for i, lv in enumerate(LEVELS) if i}})
+        return rows
+
+    def overhead_stats(self):
+        '''per cycle read time (ms) of the cycles still in the ring'''
+        cycles = min(self.count, self.size)
+        if cycles == 0:
+            return {'cycles': 0}
+        ms = sorted(v * 1000 for v in self.overhead[:cycles])
+        return {'cycles': self.count, 'missed': self.missed,
+                'period_ms': round(self.period * 1000, 3),
+                'mean_ms': round(sum(ms) / cycles, 3),
+                'p99_ms': round(ms[min(cycles - 1, int(cycles * 0.99))], 3),
+                'max_ms': round(ms[-1], 3)}
+
+
+class SampleWriter():
+    """Writes evaluated rows as jsonl (thresholds only when they change) or csv"""
+
+    def __init__(self, f, fmt, names):
+        self.f = f
+        self.fmt = fmt
+        self.names = names
+        self.thres = None
+        if fmt == 'csv':
+            cols = ['ts'] + [f'{n}' for n in names] + [f'{n}:level' for n in names]
+            f.write(','.join(cols) + '\n')
+        else:
+            f.write(json.dumps({'sensors': names, 'levels': LEVELS}) + '\n')
+
+    def __call__(self, rows):
+        for ts, temps, levels, thres in rows:
+            if self.fmt == 'csv':
+                self.f.write(','.join([f'{ts:.3f}'] + [f'{t:g}' for t in temps] +
+                                      [str(lv) for lv in levels]) + '\n')
+                continue
+            thres = [[None if math.isnan(v) else v for v in th] for th in thres]
+            if thres != self.thres:
+                self.thres = thres
+                keys = [key for key, _ in THRESHOLDS]
+                self.f.write(json.dumps({'ts': round(ts, 3), 'thresholds': [
+                    dict(zip(keys, th)) for th in thres]}) + '\n')
+            self.f.write(json.dumps({'ts': round(ts, 3),
+                                     'temp': [None if math.isnan(t) else t for t in temps],
+                                     'level': levels}, separators=(',', ':')) + '\n')
+        self.f.flush()
+
+    def close(self, stats, overhead):
+        if self.fmt == 'jsonl':
+            self.f.write(json.dumps({'stats': stats, 'overhead': overhead}) + '\n')
+        self.f.flush()
+
+################## click shell #######################
+
+@click.group(invoke_without_command=True)
+@click.pass_context
+def main(ctx):
+    '''dump thermal thresholds (by default) or sample them'''
+    if ctx.invoked_subcommand is None:
+        dump_thermal_thresholds_api2()
+
+@main.command()
+@click.option('--rate', '-r', type=click.FLOAT, default=1, show_default=True,
+              help='cycles per second')
+@click.option('--duration', '-d', type=click.FLOAT, default=60, show_default=True,
+              help='seconds to sample, Ctrl-C stops earlier')
+@click.option('--size', '-s', type=click.INT, default=4096, show_default=True,
+              help='samples kept per sensor')
+@click.option('--batch', '-b', type=click.INT, default=0,
+              help='cycles per evaluation and output, one second worth by default')
+@click.option('--output', '-o', type=click.File('w'), default='-', help='defaults to stdout')
+@click.option('--format', '-f', 'fmt', type=click.Choice(['jsonl', 'csv']), default='jsonl',
+              show_default=True)
+def sample(rate, duration, size, batch, output, fmt):
+    '''sample temperatures and thresholds, report threshold crossings'''
+    thermals = _get_all_thermals()
+    sampler = ThermalSampler(thermals, rate, size, batch)
+    writer = SampleWriter(output, fmt, sampler.names)
+    sampler.run(duration, writer)
+    stats, overhead = sampler.stats(), sampler.overhead_stats()
+    writer.close(stats, overhead)
+    print(tabulate(stats, 'keys', tablefmt='simple'), file=sys.stderr)
+    print(' '.join(f'{k}={v}' for k, v in overhead.items()), file=sys.stderr)
+
 
 if __name__ == '__main__':
-    dump_thermal_thresholds_api2()
+    main()
@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+from tabulate import tabulate
 import json
+import time
+import click
+
+@lru_cache(maxsize=None)
+def _getall_funcs_of(cls):
+    return [func for func in dir(cls) if callable(getattr(cls, func)) and func.startswith("get_all_")]
 
 def get_getall_funcs(obj):
-    '''Returns a list of get_all_XXXX() of given obj.'''
-    return [func for func in dir(obj) if callable(getattr(obj, func)) and func.startswith("get_all_")]
+    '''Returns a list of get_all_XXXX() of given obj, cached per class.'''
+    return _getall_funcs_of(type(obj))
 
 def func_to_key(method):
     '''e.g. return "thermals" while "get_all_thermals" is given'''
@@ -15,49 +24,96 @@ def try_call(obj, func):
     except Exception as e:
         return None
 
+def timed_call(obj, func, timings):
+    '''try_call, appending (class name, func, seconds) to timings'''
+    start = time.perf_counter()
+    res = try_call(obj, func)
+    timings.append((type(obj).__name__, func, time.perf_counter() - start))
+    return res
+
+def fetch_node(obj):
+    '''return (name, [(key, children)], timings) of obj'''
+    timings = []
+    start = time.perf_counter()
+    funcs = get_getall_funcs(obj)
+    timings.append((type(obj).__name__, 'get_getall_funcs', time.perf_counter() - start))
+    name = timed_call(obj, 'get_name', timings)
+    children = []
+    for func in funcs:
+        objs = timed_call(obj, func, timings)
+        if objs==None or len(objs)==0:
+            continue
+        children.append((func_to_key(func), objs))
+    return name, children, timings
+
 class NameGroupGetter():
-    def __init__(self, chassis):
+    def __init__(self, chassis, jobs=8):
         self.__chassis = chassis
+        self.jobs = jobs
+        self.timings = [] # [(class name, func, seconds)]
 
     def get(self):
         '''
         Returns a dict represents the hierarchy of pheripherals and the their
         names obtained by get_name().
-        '''
-        def serialize(obj, data):
-            '''data is a dict'''
-            data['name'] = try_call(obj, 'get_name')
-            for func in get_getall_funcs(obj):
-                children = try_call(obj, func)
-                if children==None or len(children)==0:
-                    continue
-                key = func_to_key(func)
-                data[key] = list()
-                serialize_list(children, data[key])
-
-        def serialize_list(objs, data):
-            '''data is a list'''
-            for obj in objs:
-                subdata = dict()
-                data.append(subdata)
-                serialize(obj, subdata)
 
+        Nodes are fetched by a pool of jobs threads as soon as their parent is
+        done, the dicts are filled by this thread only, in the order of the
+        get_all_XXXX() methods and their results, so the output doesn't depend
+        on which call returns first.
+        '''
         def chassis_post_process(data):
             '''drop fans if fan_drawers exists.'''
             if 'fans' in data and 'fan_drawers' in data:
                 data.pop('fans', None)
 
         obj = {'chassis': dict()}
-        serialize(self.__chassis, obj['chassis'])
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            pending = {pool.submit(fetch_node, self.__chassis): obj['chassis']}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    data = pending.pop(fut)
+                    name, children, timings = fut.result()
+                    self.timings += timings
+                    data['name'] = name
+                    for key, objs in children:
+                        data[key] = list()
+                        for child in objs:
+                            subdata = dict()
+                            data[key].append(subdata)
+                            pending[pool.submit(fetch_node, child)] = subdata
         chassis_post_process(obj['chassis'])
         return obj
 
-def main():
+    def timing_table(self):
+        '''[class, func, calls, total, max] sorted by total seconds'''
+        stats = dict()
+        for cls, func, sec in self.timings:
+            calls, total, longest = stats.get((cls, func), (0, 0.0, 0.0))
+            stats[(cls, func)] = (calls + 1, total + sec, max(longest, sec))
+        return sorted(([cls, func, *v] for (cls, func), v in stats.items()),
+                      key=lambda row: row[3], reverse=True)
+
+@click.command()
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=8, show_default=True,
+              help='number of threads calling the platform APIs')
+@click.option('--timings', is_flag=True, default=False,
+              help='report time spent per class and method')
+@click.option('--output', '-o', type=click.STRING, default='platform.json', show_default=True)
+def main(jobs, timings, output):
+    '''generate platform.json with the names of all peripherals'''
     import sonic_platform.platform
+    start = time.perf_counter()
     ch = sonic_platform.platform.Platform().get_chassis()
-    names = NameGroupGetter(ch).get()
-    with open('platform.json', 'w') as f:
+    getter = NameGroupGetter(ch, jobs)
+    names = getter.get()
+    with open(output, 'w') as f:
         json.dump(names, f, indent=4)
+    if timings:
+        print(tabulate(getter.timing_table(), ['class', 'method', 'calls', 'total(s)', 'max(s)'],
+                       tablefmt='simple', floatfmt='.4f'))
+        print(f'elapsed {time.perf_counter() - start:.3f}s with {jobs} jobs')
     print('Done!')
 
 if __name__ == "__main__":
@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 
-import sonic_platform
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from tabulate import tabulate
+import json
+import math
+import random
+import threading
 import time
 import click
 import os
 
+TIMEOUT = 'Timeout'
+
 def is_user_root():
     return os.geteuid() == 0
 
 def get_chassis():
+    import sonic_platform.platform
     return sonic_platform.platform.Platform().get_chassis()
 
 def get_method_list(obj):
@@ -21,6 +29,42 @@ def try_get(obj, func):
     except Exception as e:
         return type(e).__name__
 
+def try_get_timeout(obj, func, timeout):
+    '''try_get in a daemon thread, a call which doesn't return in time is left
+    behind (it can't be killed) and TIMEOUT is returned instead'''
+    res = []
+    t = threading.Thread(target=lambda: res.append(try_get(obj, func)), daemon=True)
+    t.start()
+    t.join(timeout)
+    return res[0] if res else TIMEOUT
+
+def bench_call(obj, func, times):
+    '''call obj.func() times times, return ([ns per call], errors)'''
+    method = getattr(obj, func)
+    elapsed = []
+    errors = 0
+    for _ in range(times):
+        start = time.perf_counter_ns()
+        try:
+            method()
+        except Exception:
+            errors += 1
+        elapsed.append(time.perf_counter_ns() - start)
+    return elapsed, errors
+
+def percentile(sorted_ns, pct):
+    '''nearest-rank percentile'''
+    return sorted_ns[max(0, -(-len(sorted_ns) * pct // 100) - 1)]
+
+def latency_stats(elapsed, budget_ns):
+    '''p50/p95/p99/max in ms and how many calls went over budget_ns'''
+    elapsed = sorted(elapsed)
+    stats = {f'p{p}_ms': round(percentile(elapsed, p) / 1e6, 3) for p in (50, 95, 99)}
+    stats['max_ms'] = round(elapsed[-1] / 1e6, 3)
+    stats['over_budget'] = len(elapsed) - next((i for i, ns in enumerate(elapsed) if ns > budget_ns),
+                                               len(elapsed))
+    return stats
+
 
 
 class Dumper():
@@ -31,15 +75,64 @@ class Dumper():
         self._devlist = devlist
         self._exemption = exemption
 
-    def dump(self):
+    def method_list(self):
+        '''the get APIs to call, sorted, without the exempted ones'''
+        devtype = type(self._devlist[0])
+        mlist_all = sorted(get_method_list(devtype))
+        return [func for func in mlist_all if func not in self._exemption]
+
+    @staticmethod
+    def _get_table(dev, mlist, timeout):
+        if not timeout:
+            return [[func, try_get(dev, func)] for func in mlist]
+        return [[func, try_get_timeout(dev, func, timeout)] for func in mlist]
+
+    def dump(self, jobs=1, timeout=None):
+        '''
+        jobs > 1 dumps devices concurrently (calls of one device are still in
+        sequence), the output order is the same anyway. A call taking more than
+        timeout seconds is reported as TIMEOUT.
+        '''
         if len(self._devlist) == 0:
             print(f'{type(self)}: WARN:no dev in dev_list')
             return
         devtype = type(self._devlist[0])
-        mlist_all = sorted(get_method_list(devtype))
-        mlist = [func for func in mlist_all if func not in self._exemption]
-        for i, dev in enumerate(self._devlist):
-            table = [[func, try_get(dev, func)] for func in mlist]
+        get_table = partial(self._get_table, mlist=self.method_list(), timeout=timeout)
+        if jobs > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as pool:
+                self._print_tables(devtype, pool.map(get_table, self._devlist))
+        else:
+            self._print_tables(devtype, map(get_table, self._devlist))
+
+    def bench(self, times, budget_ms):
+        '''
+        call each get API of each device times times, return per method and
+        per device latency stats, a method is flagged when any call took
+        longer than budget_ms
+        '''
+        if len(self._devlist) == 0:
+            print(f'{type(self)}: WARN:no dev in dev_list')
+            return None
+        budget_ns = budget_ms * 1e6
+        methods = dict()
+        for func in self.method_list():
+            if not func.startswith('get_'):
+                continue
+            devices = []
+            elapsed_all = []
+            for i, dev in enumerate(self._devlist):
+                elapsed, errors = bench_call(dev, func, times)
+                elapsed_all += elapsed
+                devices.append({'idx': i, 'errors': errors, **latency_stats(elapsed, budget_ns)})
+            stats = latency_stats(elapsed_all, budget_ns)
+            methods[func] = {'errors': sum(d['errors'] for d in devices), **stats,
+                             'flagged': stats['over_budget'] > 0, 'devices': devices}
+        return {'devtype': str(type(self._devlist[0])), 'times': times, 'budget_ms': budget_ms,
+                'flagged': [func for func, m in methods.items() if m['flagged']],
+                'methods': methods}
+
+    def _print_tables(self, devtype, tables):
+        for i, table in enumerate(tables):
             print(f'****** Dump {devtype} idx({i}) ******')
             print(tabulate(table, self.HEADER, tablefmt='simple', stralign='left'))
             print('')
@@ -116,6 +209,13 @@ class FanTester(Dumper):
         for fan in self._fans:
             fan.set_speed(speed)
 
+    @staticmethod
+    def _get_tolerance(fan):
+        tolerance = try_get(fan, 'get_speed_tolerance')
+        if isinstance(tolerance, int) == False:
+            tolerance = 15
+        return tolerance
+
     def test_speed_tolerance(self):
         for fan in self._fans:
             if fan.get_presence() is False:
@@ -123,27 +223,63 @@ class FanTester(Dumper):
 
             target = fan.get_target_speed()
             speed = fan.get_speed()
-            tolerance = try_get(fan, 'get_speed_tolerance')
-            if isinstance(tolerance, int) == False:
-                tolerance = 15
+            tolerance = self._get_tolerance(fan)
             if speed < target - tolerance or speed > target + tolerance:
                 print(f'{fan.get_name()} fail, target speed({target}), '\
                       f'tolerance({tolerance}), result speed({speed})')
 
-    def set_speed_test(self):
-        speeds = [60, 80, 100]
-        poll_intv = 1 # in second
-        times = 6
-
-        for speed in speeds:
-            print(f'+++++ set speed to {speed} start +++++')
-            for i in range(times):
+    def _wait_settled(self, fans, targets, tolerances, pool, rate, window, max_wait):
+        '''
+        sample fans at rate Hz until every fan stayed within its tolerance for
+        window seconds or max_wait passed, return ([settle seconds or None], [last speed])
+        '''
+        start = time.monotonic()
+        stable_since = [None] * len(fans)
+        settled = [None] * len(fans)
+        speeds = [None] * len(fans)
+        next_sample = start
+        while True:
+            now = time.monotonic()
+            speeds = list(pool.map(lambda fan: try_get(fan, 'get_speed'), fans))
+            for i, speed in enumerate(speeds):
+                if settled[i] is not None:
+                    continue
+                if isinstance(speed, (int, float)) and abs(speed - targets[i]) <= tolerances[i]:
+                    if stable_since[i] is None:
+                        stable_since[i] = now
+                    if now - stable_since[i] >= window:
+                        settled[i] = stable_since[i] - start
+                else:
+                    stable_since[i] = None
+            if all(t is not None for t in settled) or now - start >= max_wait:
+                return settled, speeds
+            next_sample += 1.0 / rate
+            time.sleep(max(0, next_sample - time.monotonic()))
+
+    def set_speed_test(self, speeds=(60, 80, 100), rate=5, window=2.0, max_wait=30.0):
+        '''
+        set each speed once, then sample all fans concurrently until each of
+        them is settled, i.e. stays within get_speed_tolerance() of the target
+        for window seconds. Report how long each fan took to settle.
+        '''
+        fans = [fan for fan in self._fans if try_get(fan, 'get_presence') is not False]
+        names = [try_get(fan, 'get_name') for fan in fans]
+        tolerances = [self._get_tolerance(fan) for fan in fans]
+        header = ['name', 'target', 'tolerance', 'settle(s)', 'last speed']
+        with ThreadPoolExecutor(max_workers=max(1, len(fans))) as pool:
+            for speed in speeds:
+                print(f'+++++ set speed to {speed} start +++++')
                 self._set_fan_speed(speed)
-                time.sleep(poll_intv)
-                self._dump_fan_speed()
-                if i == times - 1 :
-                    self.test_speed_tolerance()
-            print(f'----- set speed to {speed} end -----')
+                targets = [try_get(fan, 'get_target_speed') for fan in fans]
+                targets = [t if isinstance(t, (int, float)) else speed for t in targets]
+                settled, last = self._wait_settled(fans, targets, tolerances, pool,
+                                                   rate, window, max_wait)
+                table = [[name, target, tol, 'not settled' if t is None else f'{t:.2f}', sp]
+                         for name, target, tol, t, sp in zip(names, targets, tolerances, settled, last)]
+                print(tabulate(table, header, tablefmt='simple', stralign='right',
+                               disable_numparse=True))
+                self.test_speed_tolerance()
+                print(f'----- set speed to {speed} end -----')
 
     '''
     TODO: special tests in this peripheral
@@ -155,12 +291,149 @@ class FanTester(Dumper):
         - show
     '''
 
+class EepromPageCache():
+    """Serves read_eeprom() of an sfp from 128-byte pages cached for ttl seconds.
+
+    It is installed on the sfp instance, so the sfp's own get_ APIs, which call
+    self.read_eeprom(), go through it too. A page which can't be read whole is
+    not cached, the bytes asked are read as is then.
+    """
+    PAGE = 128
+
+    def __init__(self, sfp, ttl):
+        self.sfp = sfp
+        self.ttl = ttl
+        self._read = sfp.read_eeprom
+        self._write = getattr(sfp, 'write_eeprom', None)
+        self._pages = dict() # page -> (timestamp, bytes)
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        sfp.read_eeprom = self.read_eeprom
+        if self._write is not None:
+            sfp.write_eeprom = self.write_eeprom
+
+    def uninstall(self):
+        del self.sfp.read_eeprom
+        if self._write is not None:
+            del self.sfp.write_eeprom
+
+    def _page(self, page, now):
+        cached = self._pages.get(page)
+        if cached is not None and now - cached[0] < self.ttl:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        try:
+            data = self._read(page * self.PAGE, self.PAGE)
+        except Exception:
+            data = None
+        if data is None or len(data) != self.PAGE:
+            return None
+        self.bytes_read += self.PAGE
+        self._pages[page] = (now, bytes(data))
+        return self._pages[page][1]
+
+    def read_eeprom(self, offset, num_bytes):
+        if num_bytes <= 0:
+            return self._read(offset, num_bytes)
+        first = offset // self.PAGE
+        last = (offset + num_bytes - 1) // self.PAGE
+        now = time.monotonic()
+        buf = bytearray()
+        for page in range(first, last + 1):
+            data = self._page(page, now)
+            if data is None:
+                data = self._read(offset, num_bytes)
+                self.bytes_read += len(data) if data else 0
+                return data
+            buf += data
+        start = offset - first * self.PAGE
+        return buf[start: start + num_bytes]
+
+    def write_eeprom(self, offset, num_bytes, write_buffer):
+        for page in range(offset // self.PAGE, (offset + num_bytes - 1) // self.PAGE + 1):
+            self._pages.pop(page, None)
+        return self._write(offset, num_bytes, write_buffer)
+
+
+class SimulatedFan():
+    """A fan which follows set_speed() with a first order lag and some noise,
+    for running speed_test without hardware"""
+
+    def __init__(self, name, tau, noise=1.0, speed=50):
+        self._name = name
+        self._tau = tau
+        self._noise = noise
+        self._target = speed
+        self._speed = float(speed)
+        self._ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _update(self):
+        now = time.monotonic()
+        self._speed += (self._target - self._speed) * (1 - math.exp(-(now - self._ts) / self._tau))
+        self._ts = now
+
+    def get_name(self):
+        return self._name
+
+    def get_presence(self):
+        return True
+
+    def get_speed_tolerance(self):
+        return 10
+
+    def get_target_speed(self):
+        return self._target
+
+    def set_speed(self, speed):
+        with self._lock:
+            self._update()
+            self._target = speed
+        return True
+
+    def get_speed(self):
+        with self._lock:
+            self._update()
+            return min(100, max(0, round(self._speed + random.uniform(-self._noise, self._noise))))
+
+
+class SimulatedChassis():
+    """n simulated fans in one drawer, fan i settles in about 3 * (i + 1) * tau seconds"""
+
+    def __init__(self, n, tau=0.3):
+        self._fans = [SimulatedFan(f'SimFan-{i + 1}', tau * (i + 1)) for i in range(n)]
+
+    def get_all_fan_drawers(self):
+        return [self]
+
+    def get_all_fans(self):
+        return self._fans
+
+
 class SfpTester(Dumper):
-    def __init__(self, chassis):
+    def __init__(self, chassis, cache_ttl=0):
         exemption = {'_PddfSfp__read_eeprom_specific_bytes', 'dump_sysfs', 'get_all_thermals',
                      'get_thermal', 'read_eeprom', 'reset', 'set_lpmode', 'set_power_override',
                      'tx_disable', 'write_eeprom', 'tx_disable_channel'}
-        super().__init__(chassis.get_all_sfps(), exemption)
+        self._caches = []
+        sfps = chassis.get_all_sfps()
+        if cache_ttl > 0:
+            self._caches = [EepromPageCache(sfp, cache_ttl) for sfp in sfps]
+        super().__init__(sfps, exemption)
+
+    def dump(self, jobs=1, timeout=None):
+        super().dump(jobs, timeout)
+        if self._caches:
+            self.dump_cache_stats()
+
+    def dump_cache_stats(self):
+        header = ['idx', 'hits', 'misses', 'bytes_read']
+        table = [[i, c.hits, c.misses, c.bytes_read] for i, c in enumerate(self._caches)]
+        table.append(['total'] + [sum(row[col] for row in table) for col in (1, 2, 3)])
+        print('****** EEPROM page cache ******')
+        print(tabulate(table, header, tablefmt='simple', stralign='right'))
 
     '''
     TODO: special tests in this peripheral
@@ -218,44 +491,127 @@ def sfp():
 
 ################## dump commands #######################
 
+def dump_options(func):
+    func = click.option('--jobs', '-j', type=click.INT, default=1, show_default=True,
+                        help='devices to dump concurrently')(func)
+    func = click.option('--timeout', '-t', type=click.FLOAT, default=0,
+                        help=f'seconds before a call is reported as {TIMEOUT}, 0 to wait forever')(func)
+    return func
+
 @chassis.command()
-def dump():
+@dump_options
+def dump(jobs, timeout):
     """dump chassis info"""
-    ChassisTester(get_chassis()).dump()
+    ChassisTester(get_chassis()).dump(jobs, timeout)
 
 @thermal.command()
-def dump():
+@dump_options
+def dump(jobs, timeout):
     """dump all thermals info"""
-    ThermalTester(get_chassis()).dump()
+    ThermalTester(get_chassis()).dump(jobs, timeout)
 
 @psu.command()
-def dump():
+@dump_options
+def dump(jobs, timeout):
     """dump all PSUs info"""
-    PsuTester(get_chassis()).dump()
+    PsuTester(get_chassis()).dump(jobs, timeout)
 
 @component.command()
-def dump():
+@dump_options
+def dump(jobs, timeout):
     """dump all components info"""
-    ComponentTester(get_chassis()).dump()
+    ComponentTester(get_chassis()).dump(jobs, timeout)
 
 @fan.command()
-def dump():
+@dump_options
+def dump(jobs, timeout):
     """dump all fans info"""
-    FanTester(get_chassis()).dump()
+    FanTester(get_chassis()).dump(jobs, timeout)
 
 @sfp.command()
-def dump():
+@dump_options
+@click.option('--cache-ttl', type=click.FLOAT, default=0,
+              help='serve read_eeprom from a per port page cache kept this many seconds, 0 to disable')
+def dump(jobs, timeout, cache_ttl):
     """dump all sfp info"""
-    SfpTester(get_chassis()).dump()
+    SfpTester(get_chassis(), cache_ttl).dump(jobs, timeout)
+
+################## bench commands #######################
+
+def bench_options(func):
+    func = click.option('--times', '-n', type=click.IntRange(min=1), default=10, show_default=True,
+                        help='calls per method and device')(func)
+    func = click.option('--budget', '-b', type=click.FLOAT, default=100, show_default=True,
+                        help='flag methods with a call slower than this (ms)')(func)
+    func = click.option('--output', '-o', type=click.File('w'), default='-',
+                        help='write the json report to this file')(func)
+    return func
+
+def _bench(tester, times, budget, output):
+    result = tester.bench(times, budget)
+    if result is not None:
+        json.dump(result, output, indent=2)
+        output.write('\n')
+
+@chassis.command()
+@bench_options
+def bench(times, budget, output):
+    """benchmark chassis get APIs"""
+    _bench(ChassisTester(get_chassis()), times, budget, output)
+
+@thermal.command()
+@bench_options
+def bench(times, budget, output):
+    """benchmark thermal get APIs"""
+    _bench(ThermalTester(get_chassis()), times, budget, output)
+
+@psu.command()
+@bench_options
+def bench(times, budget, output):
+    """benchmark PSU get APIs"""
+    _bench(PsuTester(get_chassis()), times, budget, output)
+
+@component.command()
+@bench_options
+def bench(times, budget, output):
+    """benchmark component get APIs"""
+    _bench(ComponentTester(get_chassis()), times, budget, output)
+
+@fan.command()
+@bench_options
+def bench(times, budget, output):
+    """benchmark fan get APIs"""
+    _bench(FanTester(get_chassis()), times, budget, output)
+
+@sfp.command()
+@bench_options
+def bench(times, budget, output):
+    """benchmark sfp get APIs"""
+    _bench(SfpTester(get_chassis()), times, budget, output)
 
 ################## other commands #######################
 
 @fan.command()
-def speed_test():
+@click.option('--speeds', type=click.STRING, default='60,80,100', show_default=True,
+              help='speed steps in percent')
+@click.option('--rate', type=click.FLOAT, default=5, show_default=True,
+              help='samples per second')
+@click.option('--window', type=click.FLOAT, default=2.0, show_default=True,
+              help='seconds a fan must stay within tolerance to be settled')
+@click.option('--max-wait', type=click.FLOAT, default=30.0, show_default=True,
+              help='seconds to wait for fans to settle at each step')
+@click.option('--simulate', type=click.INT, default=0,
+              help='test this many simulated fans instead of the real ones')
+def speed_test(speeds, rate, window, max_wait, simulate):
     """perform a set_speed() -> get_speed() test"""
-    if is_user_root() is False:
-        raise PermissionError('You need root privilege to do this')
-    FanTester(get_chassis()).set_speed_test()
+    if simulate:
+        chassis = SimulatedChassis(simulate)
+    else:
+        if is_user_root() is False:
+            raise PermissionError('You need root privilege to do this')
+        chassis = get_chassis()
+    speeds = [int(s) for s in speeds.split(',')]
+    FanTester(chassis).set_speed_test(speeds, rate, window, max_wait)
 
 
 